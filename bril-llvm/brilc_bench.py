@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Measure how brilc's compile time scales with the size of a function.
+#
+# Usage: python3 brilc_bench.py [LEAVES...]
+#
+# For each size, generate a function whose body is a loop around a balanced
+# tree of branches with LEAVES leaves (so about 2*LEAVES blocks), each of which
+# updates a variable that needs a phi at the loop latch. Then time `brilc` on
+# it (including startup and LLVM emission) and print the time per block.
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+BRILC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'brilc')
+
+SIZES = [64, 256, 1024, 4096]
+
+
+def gen_prog(leaves):
+    instrs = [
+        {'op': 'const', 'dest': 'n', 'type': 'int', 'value': 10},
+        {'op': 'const', 'dest': 'i', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'label': 'header'},
+        {'op': 'lt', 'dest': 'c', 'type': 'bool', 'args': ['i', 'n']},
+        {'op': 'br', 'args': ['c'], 'labels': ['t1', 'exit']},
+    ]
+
+    # Internal nodes of the tree are numbered 1 through leaves-1, with
+    # children 2k and 2k+1, and the leaves follow.
+    for k in range(1, 2 * leaves):
+        instrs.append({'label': 't{}'.format(k)})
+        instrs.append({'op': 'const', 'dest': 'k', 'type': 'int', 'value': k})
+        if k < leaves:
+            instrs.append({'op': 'lt', 'dest': 'd', 'type': 'bool',
+                           'args': ['x', 'k']})
+            instrs.append({'op': 'br', 'args': ['d'],
+                           'labels': ['t{}'.format(2 * k),
+                                      't{}'.format(2 * k + 1)]})
+        else:
+            instrs.append({'op': 'add', 'dest': 'x', 'type': 'int',
+                           'args': ['x', 'k']})
+            instrs.append({'op': 'jmp', 'labels': ['latch']})
+
+    instrs += [
+        {'label': 'latch'},
+        {'op': 'add', 'dest': 'i', 'type': 'int', 'args': ['i', 'one']},
+        {'op': 'jmp', 'labels': ['header']},
+        {'label': 'exit'},
+        {'op': 'print', 'args': ['x']},
+    ]
+    return {'functions': [{'name': 'main', 'instrs': instrs}]}
+
+
+def bench(leaves):
+    prog = json.dumps(gen_prog(leaves))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, BRILC], input=prog, check=True,
+                   stdout=subprocess.DEVNULL, universal_newlines=True)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    print('{:>8} {:>10} {:>10}'.format('blocks', 'time (s)', 'ms/block'))
+    for leaves in sizes:
+        nblocks = 2 * leaves + 3
+        t = bench(leaves)
+        print('{:>8} {:10.3f} {:10.3f}'.format(nblocks, t, t / nblocks * 1e3))
@@ -3,86 +3,115 @@
 import sys
 import json
 from brilpy import *
-from functools import reduce
 
 class Dominators:
-
+    # Computes immediate dominators with the iterative algorithm from Cooper,
+    # Harvey, and Kennedy ("A Simple, Fast Dominance Algorithm"), and derives
+    # the dominator tree and dominance frontiers from them. Attributes:
+    #   idom:     idx -> idx of immediate dominator (None for the entry and for
+    #             unreachable blocks)
+    #   dom_tree: idx -> list of children in the dominator tree (the entry and
+    #             unreachable blocks are children of None)
+    #   frontier: idx -> set of blocks in its dominance frontier
+    #   doms:     idx -> set of blocks that dominate it (computed on demand)
+    #   dom_by:   idx -> set of blocks it dominates (computed on demand)
     def __init__(self, func):
         g = CFG(func)
-
-        # First compute dominators
-        # IMPORTANT: This computes, for each block, the set of blocks that dominate
-        # it, not the other way around
-        self.doms = []
-        self.doms.append(set([0])) # Entry block is special, it's its own dominator
-        for i in range(1,g.n):
-            self.doms.append(set(range(g.n)))
-
-        order = g.rpo()
-
+        self.n = g.n
+
+        # Number the blocks reachable from the entry in reverse postorder,
+        # without recursion (functions can be very large).
+        post = []
+        seen = [False] * g.n
+        seen[0] = True
+        stack = [(0, iter(g.edges[0]))]
+        while stack:
+            b, it = stack[-1]
+            for s in it:
+                if not seen[s]:
+                    seen[s] = True
+                    stack.append((s, iter(g.edges[s])))
+                    break
+            else:
+                stack.pop()
+                post.append(b)
+        self.order = post[::-1]
+
+        rpo_num = [None] * g.n
+        for i, b in enumerate(self.order):
+            rpo_num[b] = i
+
+        def intersect(a, b):
+            while a != b:
+                while rpo_num[a] > rpo_num[b]:
+                    a = idom[a]
+                while rpo_num[b] > rpo_num[a]:
+                    b = idom[b]
+            return a
+
+        idom = [None] * g.n
+        idom[0] = 0
         changed = True
         while changed:
             changed = False
-            for i in order[1:]: # no one can dominate 0 except 0
-                d = {i}
-                if g.preds[i]:
-                    d |= reduce(set.intersection, [self.doms[p] for p in g.preds[i]], set(range(g.n)))
-
-                if d != self.doms[i]:
+            for b in self.order[1:]:
+                new_idom = None
+                for p in g.preds[b]:
+                    if idom[p] is not None:  # processed (and reachable)
+                        if new_idom is None:
+                            new_idom = p
+                        else:
+                            new_idom = intersect(p, new_idom)
+                if new_idom != idom[b]:
+                    idom[b] = new_idom
                     changed = True
-                    self.doms[i] = d
-
-        # Compute the "other way around" (from above), that is, for each block, the
-        # set of blocks this block dominates
-        self.dom_by = []
-        for i in range(g.n):
-            self.dom_by.append(set())
-
-        for i,d in enumerate(self.doms):
-            for mbr in d:
-                self.dom_by[mbr].add(i)
-
-
+        idom[0] = None
+        self.idom = idom
 
         # Compute the dominance tree
-        dt_parent = [None]
-
+        self.dom_tree = {None: [0]}
         for i in range(1, g.n):
-            for j in self.doms[i]:
-                if i != j:  # j strictly dominates i
-                    immed_dom = True
-                    for k in range(g.n):
-                        if k != j and k != i and j in self.doms[k] and k in self.doms[i]:
-                            immed_dom = False
-                            break
-                    if immed_dom:
-                        dt_parent.append(j)
-                        break
-
-        self.dom_tree = {}
-        for i,p in enumerate(dt_parent):
+            p = idom[i]
             if p in self.dom_tree:
                 self.dom_tree[p].append(i)
             else:
                 self.dom_tree[p] = [i]
 
-        # Compute dominance frontier
+        # Compute dominance frontier: walk up the tree from each predecessor
+        # until we hit the block's immediate dominator.
         self.frontier = []
         for i in range(g.n):
             self.frontier.append(set())
 
-        for i,d in enumerate(self.doms):
-            # Union of dominators for this node's preds
-            pre_doms = reduce(set.union, [self.doms[p] for p in g.preds[i]], set())
-            # Subtract out strict dominators for this node
-            pre_doms = pre_doms.difference(self.doms[i].difference(set([i])))
-
-            # This node is in the frontier for the remaining nodes:
-            for p in pre_doms:
-                self.frontier[p].add(i)
-
-
-
+        for i in range(g.n):
+            for p in g.preds[i]:
+                runner = p
+                while runner is not None and runner != idom[i]:
+                    self.frontier[runner].add(i)
+                    runner = idom[runner]
+
+        self._doms = None
+        self._dom_by = None
+
+    # IMPORTANT: This is, for each block, the set of blocks that dominate it,
+    # not the other way around
+    @property
+    def doms(self):
+        if self._doms is None:
+            self._doms = [{i} for i in range(self.n)]
+            for i in self.order[1:]:
+                self._doms[i] |= self._doms[self.idom[i]]
+        return self._doms
+
+    # For each block, the set of blocks this block dominates
+    @property
+    def dom_by(self):
+        if self._dom_by is None:
+            self._dom_by = [set() for i in range(self.n)]
+            for i, d in enumerate(self.doms):
+                for mbr in d:
+                    self._dom_by[mbr].add(i)
+        return self._dom_by
 
 
 def main():
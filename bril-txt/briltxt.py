@@ -5,11 +5,20 @@ human-editable representation of Bril programs. There are two commands:
 `bril2txt`, which takes a Bril program in its (canonical) JSON format and
 pretty-prints it in the text format, and `bril2json`, which parses the
 format and emits the ordinary JSON representation.
+
+It also defines a compact binary encoding of the JSON representation,
+which is much faster to load and store for large programs. The
+`bril2bin` command converts JSON to the binary format and `bin2json`
+converts it back.
 """
 
 import lark
 import sys
 import json
+import mmap
+import os
+import re
+import struct
 
 __version__ = '0.0.1'
 
@@ -22,7 +31,7 @@ start: (struct | func)*
 struct: STRUCT IDENT "=" "{" mbr* "}"
 mbr: IDENT ":" type ";"
 
-func: FUNC ["(" arg_list? ")"] [tyann] "{" instr* "}"
+func: FUNC ["(" arg_list ")"] [tyann] "{" instr* "}"
 arg_list: | arg ("," arg)*
 arg: IDENT ":" type
 ?instr: const | vop | eop | label
@@ -190,10 +199,38 @@ class JSONTransformer(lark.Transformer):
         return 0
 
 
+# The same grammar for lark's LALR(1) parser. The rule priorities above
+# only exist to disambiguate the Earley parse; LALR does not need them,
+# because the contextual lexer always tokenizes the `const` keyword
+# distinctly from an identifier.
+LALR_GRAMMAR = re.sub(r'^(\w+)\.\d+:', r'\1:', GRAMMAR, flags=re.M)
+
+_parser = None
+
+
+def get_parser():
+    """Get the (shared) LALR parser for the text format.
+
+    The parser transforms directly to JSON data while parsing, without
+    building an intermediate tree. The compiled parse tables are cached
+    in a file in the system's temporary directory, so only the first
+    invocation ever pays to build them.
+    """
+    global _parser
+    if _parser is None:
+        _parser = lark.Lark(
+            LALR_GRAMMAR,
+            parser='lalr',
+            lexer='contextual',
+            transformer=JSONTransformer(),
+            maybe_placeholders=True,
+            cache=True,
+        )
+    return _parser
+
+
 def parse_bril(txt):
-    parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
-    tree = parser.parse(txt)
-    data = JSONTransformer().transform(tree)
+    data = get_parser().parse(txt)
     return json.dumps(data, indent=2, sort_keys=True)
 
 
@@ -279,11 +316,514 @@ def print_prog(prog):
         print_func(func)
 
 
+# Streaming conversion.
+#
+# These functions convert programs one top-level declaration at a time,
+# so memory use is bounded by the largest function instead of the whole
+# program. Their output is identical to the non-streaming versions.
+
+def split_decls(lines):
+    """Split the text of a Bril program into the source text of each
+    top-level declaration (function or struct).
+
+    This relies only on the braces that delimit declarations, which
+    never nest inside a function body.
+    """
+    chunk = []
+    depth = 0
+    for line in lines:
+        code = line.split('#', 1)[0]
+        if '{' not in code and '}' not in code:
+            chunk.append(line)
+            continue
+
+        # Scan for braces that close a declaration.
+        start = 0
+        for i, c in enumerate(code):
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+                if depth == 0:
+                    chunk.append(line[start:i + 1])
+                    yield ''.join(chunk)
+                    chunk = []
+                    start = i + 1
+        chunk.append(line[start:])
+
+    if ''.join(chunk).split('#', 1)[0].strip():
+        yield ''.join(chunk)  # Trailing garbage; let the parser complain.
+
+
+def _indented_json(data, level):
+    """Dump JSON as `json.dumps(..., indent=2)` would when the value is
+    nested `level` levels deep.
+    """
+    return json.dumps(data, indent=2, sort_keys=True).replace(
+        '\n', '\n' + '  ' * level
+    )
+
+
+def parse_bril_stream(lines, out):
+    """Parse a Bril program from an iterable of lines of text and write
+    its JSON to the `out` file, one function at a time.
+    """
+    parser = get_parser()
+    structs = []
+    nfuncs = 0
+    for decl in split_decls(lines):
+        data = parser.parse(decl)
+        structs += data.get('structs', [])
+        for func in data['functions']:
+            out.write('{}\n    {}'.format(
+                ',' if nfuncs else '{\n  "functions": [',
+                _indented_json(func, 2),
+            ))
+            nfuncs += 1
+
+    # Object keys are sorted, so the (few) structs come last.
+    out.write('\n  ]' if nfuncs else '{\n  "functions": []')
+    if structs:
+        out.write(',\n  "structs": {}'.format(_indented_json(structs, 1)))
+    out.write('\n}\n')
+
+
+def load_functions(f, bufsize=1 << 16):
+    """Incrementally decode the functions in a JSON Bril program from
+    the file `f`, generating them one at a time.
+
+    Other keys in the top-level object are skipped.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def more():
+        """Read more text, dropping what has been consumed. Return
+        False at the end of the file.
+        """
+        nonlocal buf, pos, eof
+        data = f.read(max(bufsize, len(buf) - pos))
+        buf = buf[pos:] + data
+        pos = 0
+        eof = not data
+        return not eof
+
+    def skip(chars=' \t\n\r'):
+        """Skip whitespace, and return the next character."""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not more():
+                raise ValueError('unexpected end of JSON input')
+
+    def decode():
+        """Decode one complete JSON value."""
+        nonlocal pos
+        skip()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more()
+
+    def expect(c):
+        nonlocal pos
+        if skip() != c:
+            raise ValueError('expected {!r} in JSON input'.format(c))
+        pos += 1
+
+    expect('{')
+    if skip() == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        if key == 'functions':
+            expect('[')
+            if skip() != ']':
+                while True:
+                    yield decode()
+                    if skip() != ',':
+                        break
+                    pos += 1
+            expect(']')
+        else:
+            decode()
+        if skip() != ',':
+            break
+        pos += 1
+    expect('}')
+
+
+# Binary format.
+#
+# A binary file consists of a fixed header followed by five sections:
+#
+# - The string table: `nstrings + 1` little-endian u32 offsets into a
+#   blob of UTF-8 data (padded to a multiple of 4 bytes). Every variable
+#   name, label, function name, opcode, and type (in its text syntax,
+#   like `ptr<int>`) is interned here exactly once.
+# - The function table: one fixed-width `FUNC_RECORD` per function.
+# - The struct table: one `STRUCT_RECORD` per struct.
+# - The instruction table: one fixed-width `INSTR_RECORD` per
+#   instruction or label, for all functions concatenated.
+# - The operand pool: u32 string indices for instruction arguments,
+#   function names, and labels, plus (name, type) pairs for function
+#   parameters and struct members.
+#
+# Absent strings are encoded as `NO_STR`. Label records use `NO_STR` as
+# their opcode and store the label name in the destination field.
+
+BIN_MAGIC = b'BRILBIN\0'
+BIN_VERSION = 1
+NO_STR = 0xffffffff
+
+HEADER = struct.Struct('<8sIIIIIII')
+FUNC_RECORD = struct.Struct('<IIIIIIB3x')
+STRUCT_RECORD = struct.Struct('<III')
+INSTR_RECORD = struct.Struct('<IIIIHHHB8s')
+OPERAND = struct.Struct('<I')
+
+# Flag bits in instruction records. The low three bits record which list
+# keys are present (so that `"args": []` survives a round trip), and the
+# next two bits record the kind of constant in the value field.
+HAS_ARGS = 1
+HAS_FUNCS = 2
+HAS_LABELS = 4
+VALUE_SHIFT = 3
+VALUE_INT, VALUE_BOOL, VALUE_FLOAT = 1, 2, 3
+
+INT_VALUE = struct.Struct('<q')
+FLOAT_VALUE = struct.Struct('<d')
+NO_VALUE = bytes(8)
+
+
+def str_to_type(s):
+    """Parse a type in the text syntax (the inverse of `type_to_str`).
+    """
+    if s.endswith('>'):
+        key, inner = s[:-1].split('<', 1)
+        return {key: str_to_type(inner)}
+    else:
+        return s
+
+
+def _pad4(n):
+    return (n + 3) & ~3
+
+
+class _Interner:
+    """Assign dense indices to strings in order of first appearance.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def __call__(self, s):
+        if s is None:
+            return NO_STR
+        try:
+            return self.index[s]
+        except KeyError:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+            return i
+
+    def type(self, typ):
+        return self(None if typ is None else type_to_str(typ))
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return VALUE_BOOL, INT_VALUE.pack(value)
+    elif isinstance(value, float):
+        return VALUE_FLOAT, FLOAT_VALUE.pack(value)
+    else:
+        return VALUE_INT, INT_VALUE.pack(value)
+
+
+def dumps_bin(prog):
+    """Encode a Bril program (as JSON data) in the binary format.
+    """
+    intern = _Interner()
+    funcs = bytearray()
+    structs = bytearray()
+    instrs = bytearray()
+    operands = []
+    ninstrs = 0
+
+    for func in prog['functions']:
+        params = func.get('args')
+        params_start = len(operands)
+        for param in params or []:
+            operands.append(intern(param['name']))
+            operands.append(intern.type(param['type']))
+
+        instrs_start = ninstrs
+        for instr in func['instrs']:
+            ninstrs += 1
+            if 'label' in instr:
+                instrs += INSTR_RECORD.pack(
+                    NO_STR, intern(instr['label']), NO_STR,
+                    0, 0, 0, 0, 0, NO_VALUE,
+                )
+                continue
+
+            flags = 0
+            start = len(operands)
+            counts = []
+            for key, bit in (('args', HAS_ARGS), ('funcs', HAS_FUNCS),
+                             ('labels', HAS_LABELS)):
+                items = instr.get(key)
+                if items is not None:
+                    flags |= bit
+                    operands.extend(intern(i) for i in items)
+                    counts.append(len(items))
+                else:
+                    counts.append(0)
+
+            value = NO_VALUE
+            if 'value' in instr:
+                kind, value = _encode_value(instr['value'])
+                flags |= kind << VALUE_SHIFT
+
+            instrs += INSTR_RECORD.pack(
+                intern(instr['op']), intern(instr.get('dest')),
+                intern.type(instr.get('type')),
+                start, counts[0], counts[1], counts[2], flags, value,
+            )
+
+        funcs += FUNC_RECORD.pack(
+            intern(func['name']), intern.type(func.get('type')),
+            params_start, len(params or []),
+            instrs_start, ninstrs - instrs_start,
+            params is not None,
+        )
+
+    for strct in prog.get('structs', []):
+        mbrs_start = len(operands)
+        for mbr in strct['mbrs']:
+            operands.append(intern(mbr['name']))
+            operands.append(intern.type(mbr['type']))
+        structs += STRUCT_RECORD.pack(
+            intern(strct['name']), mbrs_start, len(strct['mbrs']),
+        )
+
+    # Lay out the string table.
+    blob = bytearray()
+    offsets = [0]
+    for s in intern.strings:
+        blob += s.encode('utf8')
+        offsets.append(len(blob))
+    blob += bytes(_pad4(len(blob)) - len(blob))
+
+    header = HEADER.pack(
+        BIN_MAGIC, BIN_VERSION, len(intern.strings), len(blob),
+        len(prog['functions']), len(prog.get('structs', [])), ninstrs,
+        len(operands),
+    )
+    return b''.join([
+        header,
+        struct.pack('<{}I'.format(len(offsets)), *offsets),
+        blob,
+        funcs,
+        structs,
+        instrs,
+        struct.pack('<{}I'.format(len(operands)), *operands),
+    ])
+
+
+class BinProgram:
+    """A Bril program in the binary format.
+
+    Decoding is lazy: only the header is read up front, and functions,
+    structs, and strings are decoded from the underlying buffer (which
+    may be an `mmap`) when they are requested.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        (magic, version, nstrings, blob_len, self.nfuncs, self.nstructs,
+         self.ninstrs, self.noperands) = HEADER.unpack_from(buf, 0)
+        if magic != BIN_MAGIC:
+            raise ValueError('not a binary Bril program')
+        if version != BIN_VERSION:
+            raise ValueError('unsupported binary Bril version {}'
+                             .format(version))
+
+        # Section offsets.
+        self._offsets = HEADER.size
+        self._blob = self._offsets + OPERAND.size * (nstrings + 1)
+        self._funcs = self._blob + blob_len
+        self._structs = self._funcs + FUNC_RECORD.size * self.nfuncs
+        self._instrs = self._structs + STRUCT_RECORD.size * self.nstructs
+        self._operands = self._instrs + INSTR_RECORD.size * self.ninstrs
+
+        self._strings = [None] * nstrings
+
+    def __len__(self):
+        return self.nfuncs
+
+    def string(self, idx):
+        """Get an interned string by its index (or None for `NO_STR`).
+        """
+        if idx == NO_STR:
+            return None
+        s = self._strings[idx]
+        if s is None:
+            start, end = struct.unpack_from('<II', self.buf,
+                                            self._offsets + 4 * idx)
+            s = self._strings[idx] = str(
+                self.buf[self._blob + start:self._blob + end], 'utf8'
+            )
+        return s
+
+    def _type(self, idx):
+        s = self.string(idx)
+        return None if s is None else str_to_type(s)
+
+    def _names(self, start, count):
+        ids = struct.unpack_from('<{}I'.format(count), self.buf,
+                                 self._operands + OPERAND.size * start)
+        return [self.string(i) for i in ids]
+
+    def _pairs(self, start, count):
+        flat = struct.unpack_from('<{}I'.format(2 * count), self.buf,
+                                  self._operands + OPERAND.size * start)
+        return [{'name': self.string(flat[i]), 'type': self._type(flat[i + 1])}
+                for i in range(0, len(flat), 2)]
+
+    def instr(self, idx):
+        """Decode a single instruction or label by its global index.
+        """
+        (op, dest, typ, start, nargs, nfuncs, nlabels, flags,
+         value) = INSTR_RECORD.unpack_from(
+             self.buf, self._instrs + INSTR_RECORD.size * idx
+        )
+        if op == NO_STR:
+            return {'label': self.string(dest)}
+
+        out = {'op': self.string(op)}
+        if dest != NO_STR:
+            out['dest'] = self.string(dest)
+        if typ != NO_STR:
+            out['type'] = self._type(typ)
+        if flags & HAS_ARGS:
+            out['args'] = self._names(start, nargs)
+        if flags & HAS_FUNCS:
+            out['funcs'] = self._names(start + nargs, nfuncs)
+        if flags & HAS_LABELS:
+            out['labels'] = self._names(start + nargs + nfuncs, nlabels)
+
+        kind = flags >> VALUE_SHIFT
+        if kind == VALUE_INT:
+            out['value'] = INT_VALUE.unpack(value)[0]
+        elif kind == VALUE_BOOL:
+            out['value'] = bool(INT_VALUE.unpack(value)[0])
+        elif kind == VALUE_FLOAT:
+            out['value'] = FLOAT_VALUE.unpack(value)[0]
+        return out
+
+    def function(self, idx):
+        """Decode the function at a given index to its JSON form.
+        """
+        (name, typ, params_start, nparams, instrs_start, ninstrs,
+         has_params) = FUNC_RECORD.unpack_from(
+             self.buf, self._funcs + FUNC_RECORD.size * idx
+        )
+        func = {
+            'name': self.string(name),
+            'instrs': [self.instr(i) for i in
+                       range(instrs_start, instrs_start + ninstrs)],
+        }
+        if has_params:
+            func['args'] = self._pairs(params_start, nparams)
+        if typ != NO_STR:
+            func['type'] = self._type(typ)
+        return func
+
+    def function_names(self):
+        """Get the names of all functions without decoding their bodies.
+        """
+        return [
+            self.string(FUNC_RECORD.unpack_from(
+                self.buf, self._funcs + FUNC_RECORD.size * i
+            )[0])
+            for i in range(self.nfuncs)
+        ]
+
+    def functions(self):
+        """Generate the decoded functions in order.
+        """
+        for i in range(self.nfuncs):
+            yield self.function(i)
+
+    def structs(self):
+        """Generate the decoded structs in order.
+        """
+        for i in range(self.nstructs):
+            name, start, count = STRUCT_RECORD.unpack_from(
+                self.buf, self._structs + STRUCT_RECORD.size * i
+            )
+            yield {'name': self.string(name),
+                   'mbrs': self._pairs(start, count)}
+
+    def to_json(self):
+        """Decode the entire program to its JSON form.
+        """
+        prog = {'functions': list(self.functions())}
+        if self.nstructs:
+            prog['structs'] = list(self.structs())
+        return prog
+
+
+def load_bin(f):
+    """Open a binary Bril program from a binary file object.
+
+    Regular files are mapped into memory with `mmap` so that decoding
+    can be lazy; anything else (like a pipe) is read in full.
+    """
+    try:
+        fd = f.fileno()
+        if os.fstat(fd).st_size > 0:
+            return BinProgram(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+    except (AttributeError, OSError, ValueError):
+        pass
+    return BinProgram(f.read())
+
+
 # Command-line entry points.
 
 def bril2json():
-    print(parse_bril(sys.stdin.read()))
+    if '--stream' in sys.argv[1:]:
+        parse_bril_stream(sys.stdin, sys.stdout)
+    else:
+        print(parse_bril(sys.stdin.read()))
 
 
 def bril2txt():
-    print_prog(json.load(sys.stdin))
+    if '--stream' in sys.argv[1:]:
+        for func in load_functions(sys.stdin):
+            print_func(func)
+    else:
+        print_prog(json.load(sys.stdin))
+
+
+def bril2bin():
+    sys.stdout.buffer.write(dumps_bin(json.load(sys.stdin)))
+
+
+def bin2json():
+    prog = load_bin(sys.stdin.buffer).to_json()
+    print(json.dumps(prog, indent=2, sort_keys=True))
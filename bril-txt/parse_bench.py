@@ -0,0 +1,108 @@
+"""Compare the Earley and LALR parsers for the Bril text format.
+
+Parse every `.bril` file in the repository's `benchmarks` and `test`
+directories with both parsers. Report the startup time (building or
+loading each parser) and the parse throughput in instructions per
+second, and check that both parsers produce identical JSON.
+
+Run from anywhere: `python parse_bench.py [ROOT]`, where `ROOT` defaults
+to the repository root.
+"""
+
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import lark
+
+import briltxt
+
+
+def find_sources(root):
+    paths = glob.glob(os.path.join(root, 'benchmarks', '*.bril'))
+    paths += glob.glob(os.path.join(root, 'test', '**', '*.bril'),
+                       recursive=True)
+    return sorted(paths)
+
+
+def count_instrs(data):
+    return sum(len(f['instrs']) for f in data['functions'])
+
+
+def earley_parser():
+    return lark.Lark(briltxt.GRAMMAR, maybe_placeholders=True)
+
+
+def earley_parse(parser, txt):
+    return briltxt.JSONTransformer().transform(parser.parse(txt))
+
+
+def lalr_parser(cache):
+    return lark.Lark(
+        briltxt.LALR_GRAMMAR,
+        parser='lalr',
+        lexer='contextual',
+        transformer=briltxt.JSONTransformer(),
+        maybe_placeholders=True,
+        cache=cache,
+    )
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def bench(root):
+    sources = {}
+    for path in find_sources(root):
+        with open(path) as f:
+            sources[path] = f.read()
+
+    # Startup.
+    earley, t_earley = timed(earley_parser)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_fn = os.path.join(tmp, 'briltxt.lark')
+        _, t_cold = timed(lalr_parser, cache_fn)
+        lalr, t_warm = timed(lalr_parser, cache_fn)
+    print('startup (s):')
+    print('  earley:          {:.4f}'.format(t_earley))
+    print('  lalr, no cache:  {:.4f}'.format(t_cold))
+    print('  lalr, cached:    {:.4f}'.format(t_warm))
+
+    # Parsing.
+    ninstrs = 0
+    t_earley = t_lalr = 0.0
+    mismatches = []
+    for path, txt in sources.items():
+        try:
+            old, t = timed(earley_parse, earley, txt)
+        except lark.exceptions.LarkError:
+            continue  # Not a well-formed text program.
+        t_earley += t
+        new, t = timed(lalr.parse, txt)
+        t_lalr += t
+
+        ninstrs += count_instrs(old)
+        if json.dumps(old, sort_keys=True) != json.dumps(new, sort_keys=True):
+            mismatches.append(path)
+
+    print('parsing {} files, {} instructions:'.format(len(sources), ninstrs))
+    for name, t in (('earley', t_earley), ('lalr', t_lalr)):
+        print('  {:6} {:8.4f} s  {:10.0f} instrs/s'.format(
+            name, t, ninstrs / t,
+        ))
+
+    for path in mismatches:
+        print('mismatch:', path, file=sys.stderr)
+    return not mismatches
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(here)
+    sys.exit(0 if bench(root) else 1)
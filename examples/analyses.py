@@ -0,0 +1,120 @@
+"""A per-function cache for analyses that are shared between passes.
+
+An `AnalysisManager` computes analyses of a single function on demand
+and remembers the results. When a pass modifies the function, it (or
+whoever runs it) calls `invalidate` with the set of analyses that are
+still valid afterward, and everything else is recomputed on the next
+request.
+
+The available analyses are:
+
+- `cfg`: The block map, with a unique entry block and explicit
+  terminators (see `cfg.py`). Passes may modify these blocks in place
+  and then reassemble the function from them, in which case the map
+  remains valid.
+- `graph`: The same blocks as a densely numbered `cfg.CFG`.
+- `succ` and `pred`: Successor and predecessor maps.
+- `idom`: Immediate dominators (see `dom.get_idom`).
+- `dom`, `dom_tree`, and `dom_fronts`: Dominators, the dominator tree,
+  and dominance frontiers (see `dom.py`), all derived from `idom`.
+- `dominance`: A `dom.Dominance` object for constant-time queries like
+  `am['dominance'].dominates(a, b)`.
+- `live`: The live-variable solution (see `df.py`), as a pair of maps
+  from block names to the variables live at the block's entry and exit.
+"""
+
+import sys
+from collections import Counter
+
+from cfg import CFG, block_map, successors, add_terminators, add_entry
+from form_blocks import form_blocks
+import df
+import dom
+
+# The analyses that only depend on the shape of the control-flow graph,
+# so they are preserved by any pass that neither adds nor removes blocks
+# or edges.
+CONTROL_FLOW = frozenset(['succ', 'pred', 'idom', 'dom', 'dom_tree',
+                          'dom_fronts', 'dominance'])
+
+# The analyses that hold the blocks themselves. They remain valid when a
+# pass modifies the blocks in place and reassembles the function from
+# them.
+BLOCKS = frozenset(['cfg', 'graph'])
+
+# Preserved by passes that do not modify the function at all.
+ALL = CONTROL_FLOW | BLOCKS | {'live'}
+
+
+def _cfg(am):
+    blocks = block_map(form_blocks(am.func['instrs']))
+    add_entry(blocks)
+    add_terminators(blocks)
+    return blocks
+
+
+def _succ(am):
+    return {name: successors(block[-1]) for name, block in am['cfg'].items()}
+
+
+def _idom(am):
+    succ = am['succ']
+    return dom.get_idom(succ, next(iter(succ)))
+
+
+ANALYSES = {
+    'cfg': _cfg,
+    'graph': lambda am: CFG(am['cfg']),
+    'succ': _succ,
+    'pred': lambda am: dom.map_inv(am['succ']),
+    'idom': _idom,
+    'dom': lambda am: dom.idom_dom(am['idom'], am['succ']),
+    'dom_tree': lambda am: dom.idom_tree(am['idom'], am['succ']),
+    'dom_fronts': lambda am: dom.idom_fronts(am['idom'], am['succ']),
+    'dominance': lambda am: dom.Dominance(am['idom']),
+    'live': lambda am: df.solve(am['cfg'], df.ANALYSES['live'],
+                                graph=am['graph']),
+}
+
+
+class Stats:
+    """Hit and miss counts for analysis requests, by analysis name.
+    """
+
+    def __init__(self):
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def report(self, file=sys.stderr):
+        for name in sorted(set(self.hits) | set(self.misses)):
+            print('{}: {} hits, {} misses'.format(
+                name, self.hits[name], self.misses[name],
+            ), file=file)
+
+
+class AnalysisManager:
+    """Lazily compute and cache the analyses of a function.
+
+    Look up an analysis by name, like `am['dom']`.
+    """
+
+    def __init__(self, func, stats=None):
+        self.func = func
+        self.stats = stats if stats is not None else Stats()
+        self._cache = {}
+
+    def __getitem__(self, name):
+        if name in self._cache:
+            self.stats.hits[name] += 1
+        else:
+            self.stats.misses[name] += 1
+            self._cache[name] = ANALYSES[name](self)
+        return self._cache[name]
+
+    def invalidate(self, preserved=frozenset()):
+        """Forget all the cached analyses except for those in
+        `preserved`.
+        """
+        for name in list(self._cache):
+            if name not in preserved:
+                del self._cache[name]
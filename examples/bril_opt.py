@@ -0,0 +1,150 @@
+"""Run a sequence of the example passes on a Bril program in one process.
+
+Usage: `python bril_opt.py [--stats] PASS...`, where each pass is one of:
+
+- `tdce`, `tdcep`, `dkp`, `tdce+`, or `adce`: dead code elimination
+  (see `tdce.py`).
+- `lvn`, optionally with flags like `lvn:pcf`: local value numbering with
+  propagation (`p`), canonicalization (`c`), and folding (`f`), like the
+  `-p`, `-c`, and `-f` options to `lvn.py`.
+- `gvn`: global value numbering on SSA form (see `gvn.py`).
+- `sccp`: sparse conditional constant propagation on SSA form (see
+  `sccp.py`).
+- `licm`: loop-invariant code motion on SSA form (see `licm.py`).
+- `lcm`: partial redundancy elimination by lazy code motion, not on SSA
+  form (see `lcm.py`).
+- `simplify_cfg`: control-flow graph cleanup (see `simplify_cfg.py`).
+- `layout`: block ordering for fallthrough (see `layout.py`). Use
+  `layout:FILE` to order by the block counts in a profile file.
+- `to_ssa` and `from_ssa`: conversion to and from SSA form. Use
+  `to_ssa:pruned` or `to_ssa:semi-pruned` to insert fewer phi-nodes (see
+  `to_ssa.MODES`), and `from_ssa:coalesce` to coalesce variables and
+  insert fewer copies.
+- `df:ANALYSIS`, like `df:live`: run a data flow analysis from `df.py`
+  and print its results to stderr, leaving the program unchanged.
+
+This is equivalent to piping the program through the corresponding
+scripts, but it avoids starting a new interpreter and serializing the
+program for every stage. The program is only written out (as JSON) at
+the end.
+
+Each function gets an `AnalysisManager` that lives across all the
+passes, so analyses like dominators are only recomputed when a pass
+invalidates them. With `--stats`, print the cache's hit and miss counts
+to stderr.
+"""
+
+import json
+import sys
+from contextlib import redirect_stdout
+
+import df
+import tdce
+from analyses import AnalysisManager, Stats, ALL, CONTROL_FLOW
+from lvn import lvn_func
+from gvn import gvn_func
+from sccp import sccp_func
+from licm import licm_func
+from lcm import lcm_func
+from simplify_cfg import simplify_cfg_func
+from layout import layout_func
+from to_ssa import func_to_ssa
+from from_ssa import func_from_ssa
+from util import load
+
+# Every pass takes a function, its analysis manager, and the flags from
+# its specification (or what `FLAG_PARSERS` made of them). It is
+# responsible for invalidating the analyses it does not preserve.
+
+
+def _tdce_pass(mode):
+    def run(func, am, flags):
+        # Deleting instructions usually leaves the control-flow graph
+        # alone, but it can delete an anonymous block or the last
+        # reference to the entry label (and ADCE rewrites branches), so
+        # compare the edges of the rebuilt graph.
+        succ = am['succ']
+        tdce.MODES[mode](func)
+        if AnalysisManager(func)['succ'] == succ:
+            am.invalidate(CONTROL_FLOW)
+        else:
+            am.invalidate()
+    return run
+
+
+def _lvn_pass(func, am, flags):
+    # LVN rewrites instructions in place without adding or removing any,
+    # so even the cached blocks stay valid.
+    lvn_func(func, 'p' in flags, 'c' in flags, 'f' in flags)
+    am.invalidate(ALL - {'live'})
+
+
+def _load_profile(flags):
+    if not flags:
+        return None
+    with open(flags) as f:
+        return json.load(f)
+
+
+def _df_pass(func, am, flags):
+    with redirect_stdout(sys.stderr):
+        df.run_df({'functions': [func]}, df.ANALYSES[flags])
+
+
+PASSES = {
+    'lvn': _lvn_pass,
+    'gvn': lambda func, am, flags: gvn_func(func, am),
+    'sccp': lambda func, am, flags: sccp_func(func, am),
+    'licm': lambda func, am, flags: licm_func(func, am),
+    'lcm': lambda func, am, flags: lcm_func(func, am),
+    'simplify_cfg': lambda func, am, flags: simplify_cfg_func(func, am),
+    'layout': lambda func, am, profile: layout_func(func, am, profile),
+    'to_ssa': lambda func, am, flags: func_to_ssa(func, am,
+                                                  flags or 'minimal'),
+    'from_ssa': lambda func, am, flags: func_from_ssa(
+        func, am, coalesce=flags == 'coalesce'),
+    'df': _df_pass,
+}
+PASSES.update({mode: _tdce_pass(mode) for mode in tdce.MODES})
+
+# Passes whose flags are turned into something else once, when the
+# pipeline is parsed, rather than for every function.
+FLAG_PARSERS = {
+    'layout': _load_profile,
+}
+
+
+def parse_pipeline(specs):
+    """Parse pass specifications like `lvn:pcf` into a list of (pass
+    function, flags) pairs.
+    """
+    pipeline = []
+    for spec in specs:
+        name, _, flags = spec.partition(':')
+        if name not in PASSES:
+            raise ValueError('unknown pass {}'.format(name))
+        if name in FLAG_PARSERS:
+            flags = FLAG_PARSERS[name](flags)
+        pipeline.append((PASSES[name], flags))
+    return pipeline
+
+
+def run_pipeline(bril, pipeline, stats=None):
+    managers = [AnalysisManager(func, stats) for func in bril['functions']]
+    for run, flags in pipeline:
+        for func, am in zip(bril['functions'], managers):
+            run(func, am, flags)
+    return bril
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    stats = Stats()
+    bril = run_pipeline(
+        load(sys.stdin),
+        parse_pipeline(a for a in args if a != '--stats'),
+        stats,
+    )
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    if '--stats' in args:
+        stats.report()
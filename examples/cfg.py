@@ -1,6 +1,8 @@
+import itertools
+from array import array
 from collections import OrderedDict
-from util import fresh, flatten
-from form_blocks import TERMINATORS
+from util import fresh, fresh_names
+from form_blocks import TERMINATORS, form_blocks
 
 
 def block_map(blocks):
@@ -13,6 +15,7 @@ def block_map(blocks):
     labels removed.
     """
     by_name = OrderedDict()
+    anon_names = fresh_names('b', by_name)
 
     for block in blocks:
         # Generate a name for the block.
@@ -23,7 +26,7 @@ def block_map(blocks):
             block = block[1:]
         else:
             # Make up a new name for this anonymous block.
-            name = fresh('b', by_name)
+            name = next(anon_names)
 
         # Add the block to the mapping.
         by_name[name] = block
@@ -49,20 +52,21 @@ def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
+    names = list(blocks.keys())
     for i, block in enumerate(blocks.values()):
         if not block:
             if i == len(blocks) - 1:
                 # In the last block, return.
                 block.append({'op': 'ret', 'args': []})
             else:
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({'op': 'jmp', 'labels': [dest]})
         elif block[-1]['op'] not in TERMINATORS:
             if i == len(blocks) - 1:
                 block.append({'op': 'ret', 'args': []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
+                dest = names[i + 1]
                 block.append({'op': 'jmp', 'labels': [dest]})
 
 
@@ -76,7 +80,7 @@ def add_entry(blocks):
     first_lbl = next(iter(blocks.keys()))
 
     # Check for any references to the label.
-    for instr in flatten(blocks.values()):
+    for instr in itertools.chain.from_iterable(blocks.values()):
         if 'labels' in instr and first_lbl in instr['labels']:
             break
     else:
@@ -91,23 +95,149 @@ def add_entry(blocks):
 def edges(blocks):
     """Given a block map containing blocks complete with terminators,
     generate two mappings: predecessors and successors. Both map block
-    names to lists of block names.
+    names to lists of block names, in block order (with a duplicate for
+    a branch that names the same target twice).
+
+    These are a view of `CFG`, which analyses that want integer block
+    numbers can use directly.
     """
-    preds = {name: [] for name in blocks}
-    succs = {name: [] for name in blocks}
-    for name, block in blocks.items():
-        for succ in successors(block[-1]):
-            succs[name].append(succ)
-            preds[succ].append(name)
-    return preds, succs
+    return CFG(blocks).edges()
 
 
 def reassemble(blocks):
-    """Flatten a CFG into an instruction list."""
-    # This could optimize slightly by opportunistically eliminating
-    # `jmp .next` and `ret` terminators where it is allowed.
+    """Flatten a CFG into an instruction list.
+
+    Every terminator stays explicit. See `reassemble_compact` for a
+    version that leaves out the ones control falls through anyway, and
+    `layout.py` for ordering blocks so that more of them do.
+    """
     instrs = []
     for name, block in blocks.items():
         instrs.append({'label': name})
         instrs += block
     return instrs
+
+
+def reassemble_compact(blocks, labels=()):
+    """Flatten a CFG into an instruction list like `reassemble`, but
+    leave out the terminators that control would fall through anyway:
+    jumps to the next block, and a `ret` without arguments at the very
+    end (unless it is the only instruction left, since the block map of
+    an empty function has no entry). Labels that nothing jumps to are
+    left out too, except for those in `labels`.
+    """
+    instrs = reassemble(blocks)
+    instrs = [
+        instr for i, instr in enumerate(instrs)
+        if not (instr.get('op') == 'jmp' and i + 1 < len(instrs) and
+                instrs[i + 1].get('label') == instr['labels'][0])
+    ]
+    last = instrs[-1] if instrs else {}
+    if last.get('op') == 'ret' and not last.get('args') and \
+            any('op' in instr for instr in instrs[:-1]):
+        instrs.pop()
+    used = {lbl for instr in instrs for lbl in instr.get('labels', [])}
+    used.update(labels)
+    return [instr for instr in instrs
+            if 'label' not in instr or instr['label'] in used]
+
+
+class CFG:
+    """A control-flow graph with densely numbered blocks.
+
+    Blocks are numbered 0 through `n - 1` in the order of the block map
+    they come from, so block 0 is the entry. `names` and `index` convert
+    between block numbers and names. The edges are stored in
+    compressed sparse row form: the successors of block `i` are
+    `succ[succ_start[i]:succ_start[i + 1]]`, and likewise for
+    predecessors. Both lists are in block order, and a branch that
+    names the same target twice contributes two edges.
+    """
+
+    def __init__(self, blocks):
+        """Build the graph from a block map with terminators.
+        """
+        self.names = list(blocks.keys())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.blocks = list(blocks.values())
+        self.n = n = len(self.names)
+
+        # Successors, in block order.
+        self.succ = array('i')
+        self.succ_start = array('i', [0])
+        for block in self.blocks:
+            self.succ.extend(self.index[s] for s in successors(block[-1]))
+            self.succ_start.append(len(self.succ))
+
+        # Predecessors, by counting sort on the successor array.
+        counts = array('i', bytes(4 * (n + 1)))
+        for s in self.succ:
+            counts[s + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.pred_start = array('i', counts)
+        self.pred = array('i', bytes(4 * len(self.succ)))
+        for i in range(n):
+            for j in range(self.succ_start[i], self.succ_start[i + 1]):
+                s = self.succ[j]
+                self.pred[counts[s]] = i
+                counts[s] += 1
+
+    @classmethod
+    def from_instrs(cls, instrs):
+        """Form the CFG for a function body, with a unique entry block
+        and explicit terminators.
+        """
+        blocks = block_map(form_blocks(instrs))
+        add_entry(blocks)
+        add_terminators(blocks)
+        return cls(blocks)
+
+    def succs(self, i):
+        return self.succ[self.succ_start[i]:self.succ_start[i + 1]]
+
+    def preds(self, i):
+        return self.pred[self.pred_start[i]:self.pred_start[i + 1]]
+
+    def block_map(self):
+        """Get the blocks as an `OrderedDict` from names to blocks.
+        """
+        return OrderedDict(zip(self.names, self.blocks))
+
+    def edges(self):
+        """Get the predecessor and successor maps by name, like `edges`.
+        """
+        names = self.names
+        preds = {names[i]: [names[p] for p in self.preds(i)]
+                 for i in range(self.n)}
+        succs = {names[i]: [names[s] for s in self.succs(i)]
+                 for i in range(self.n)}
+        return preds, succs
+
+    def postorder(self, root=0):
+        """List the blocks reachable from `root` in postorder.
+        """
+        out = []
+        visited = bytearray(self.n)
+        visited[root] = 1
+        # A stack of (block, position of the next successor to visit).
+        stack = [(root, self.succ_start[root])]
+        while stack:
+            node, pos = stack[-1]
+            if pos < self.succ_start[node + 1]:
+                stack[-1] = (node, pos + 1)
+                s = self.succ[pos]
+                if not visited[s]:
+                    visited[s] = 1
+                    stack.append((s, self.succ_start[s]))
+            else:
+                stack.pop()
+                out.append(node)
+        return out
+
+    def rpo(self, root=0):
+        """List the blocks reachable from `root` in reverse postorder.
+        """
+        out = self.postorder(root)
+        out.reverse()
+        return out
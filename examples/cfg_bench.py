@@ -0,0 +1,81 @@
+"""Measure how CFG construction scales with the number of blocks.
+
+Usage: `python cfg_bench.py [SIZE...]`. For each size (by default
+10^3 through 10^6 blocks), generate a synthetic function and time each
+stage of building its CFG: `form_blocks`, `block_map`, `add_entry`,
+`add_terminators`, and `edges`. Print the time per stage and the time
+per block, which should stay roughly constant as the size grows.
+"""
+
+import sys
+import time
+
+from cfg import block_map, add_entry, add_terminators, edges
+from form_blocks import form_blocks
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+
+
+def gen_func(nblocks):
+    """Generate the instructions of a function with about `nblocks`
+    basic blocks.
+
+    Every block computes a value. A quarter of the blocks are anonymous
+    (so they need generated names) and the others are labeled. Labeled
+    blocks end with a branch back to the entry label, a jump, or (every
+    third one) nothing, so they fall through to the next block.
+    """
+    instrs = [
+        {'label': 'l0'},
+        {'op': 'const', 'dest': 'c', 'type': 'bool', 'value': True},
+    ]
+    for i in range(1, nblocks):
+        if i % 4:
+            instrs.append({'label': 'l{}'.format(i)})
+        instrs.append({'op': 'const', 'dest': 'x', 'type': 'int',
+                       'value': i})
+
+        # The next labeled block.
+        target = 'l{}'.format(min(i + 1 if (i + 1) % 4 else i + 2, nblocks))
+        if i % 4 == 3:
+            instrs.append({'op': 'jmp', 'labels': [target]})
+        elif i % 3 == 1:
+            instrs.append({'op': 'br', 'args': ['c'],
+                           'labels': ['l0', target]})
+    instrs.append({'label': 'l{}'.format(nblocks)})
+    instrs.append({'op': 'ret'})
+    return instrs
+
+
+def bench(nblocks):
+    instrs = gen_func(nblocks)
+    times = []
+
+    def stage(func, *args):
+        start = time.perf_counter()
+        res = func(*args)
+        times.append(time.perf_counter() - start)
+        return res
+
+    blocks = stage(lambda: list(form_blocks(instrs)))
+    blocks = stage(block_map, blocks)
+    stage(add_entry, blocks)
+    stage(add_terminators, blocks)
+    stage(edges, blocks)
+    return len(blocks), times
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    print('{:>9} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'blocks', 'form', 'block_map', 'add_entry', 'add_terms', 'edges',
+        'total (s)', 'us/block',
+    ))
+    for size in sizes:
+        nblocks, times = bench(size)
+        print('{:>9} {} {:10.4f} {:9.2f}'.format(
+            nblocks,
+            ' '.join('{:10.4f}'.format(t) for t in times),
+            sum(times),
+            sum(times) / nblocks * 1e6,
+        ))
@@ -1,9 +1,11 @@
+import heapq
 import sys
-import json
 from collections import namedtuple
 
 from form_blocks import form_blocks
 import cfg
+from tdce import drop_killed_local
+from util import load
 
 # A single dataflow analysis consists of these part:
 # - forward: True for forward, False for backward.
@@ -20,46 +22,278 @@ def union(sets):
     return out
 
 
-def df_worklist(blocks, analysis):
+class SolverStats:
+    """Counters for checking how quickly the solver converges.
+
+    `transfers` counts calls to the transfer function. `iterations`
+    counts passes over the blocks: a new pass starts whenever the
+    solver has to go back to a block earlier in its priority order.
+    """
+
+    def __init__(self):
+        self.transfers = 0
+        self.iterations = 0
+
+    def __str__(self):
+        return '{} iterations, {} transfers'.format(
+            self.iterations, self.transfers,
+        )
+
+
+def df_worklist(blocks, analysis, stats=None, graph=None):
     """The worklist algorithm for iterating a data flow analysis to a
     fixed point.
     """
-    preds, succs = cfg.edges(blocks)
+    if graph is None:
+        graph = cfg.CFG(blocks)
+    return _solve(blocks, graph, analysis, stats)
+
+
+def _order(graph):
+    """Get the numbers of the blocks in reverse postorder from the
+    entry, followed by any unreachable blocks in their original order.
+    """
+    if not graph.n:
+        return []
+    order = graph.rpo()
+    seen = bytearray(graph.n)
+    for i in order:
+        seen[i] = 1
+    return order + [i for i in range(graph.n) if not seen[i]]
+
+
+def _reachable(roots, edges):
+    """Get the set of nodes reachable from `roots` (including them),
+    where `edges(n)` lists the neighbors of node `n`.
+    """
+    seen = set(roots)
+    stack = list(seen)
+    while stack:
+        for n in edges(stack.pop()):
+            if n not in seen:
+                seen.add(n)
+                stack.append(n)
+    return seen
+
+
+def _solve(blocks, graph, analysis, stats=None, prev=None, modified=None):
+    """Run the worklist algorithm over the edges of `graph`, a `cfg.CFG`
+    of the function. The `blocks` map may contain anything the
+    analysis's transfer function accepts. Inside the loop, blocks are
+    referred to by their numbers in `graph`; the results are maps from
+    block names.
+
+    The worklist is a priority queue without duplicates. Forward
+    analyses visit blocks in reverse postorder, and backward analyses
+    visit them in postorder, so a block is usually visited after the
+    blocks it depends on.
+
+    To update an old solution `prev` (an `(in, out)` pair), pass the
+    names of the blocks that changed since then as `modified`.
+    """
+    names = graph.names
+    order = _order(graph)
 
     # Switch between directions.
     if analysis.forward:
-        first_block = list(blocks.keys())[0]  # Entry.
-        in_edges = preds
-        out_edges = succs
+        in_edges = graph.preds
+        out_edges = graph.succs
     else:
-        first_block = list(blocks.keys())[-1]  # Exit.
-        in_edges = succs
-        out_edges = preds
+        order.reverse()
+        in_edges = graph.succs
+        out_edges = graph.preds
+    priority = [0] * graph.n
+    for i, node in enumerate(order):
+        priority[node] = i
+    values = [blocks[name] for name in names]
 
     # Initialize.
-    in_ = {first_block: analysis.init}
-    out = {node: analysis.init for node in blocks}
+    in_ = [None] * graph.n
+    out = [analysis.init] * graph.n
+    if prev is None:
+        dirty = order
+    else:
+        # Only the blocks downstream of a modification can change.
+        # Starting those over from the initial value (rather than from
+        # their old values) makes sure we find the same fixed point as
+        # a solve from scratch, even when facts shrink around a loop.
+        old_in, old_out = prev if analysis.forward else prev[::-1]
+        dirty = _reachable((graph.index[name] for name in modified),
+                           out_edges)
+        for node, name in enumerate(names):
+            if node not in dirty:
+                in_[node] = old_in[name]
+                out[node] = old_out[name]
 
     # Iterate.
-    worklist = list(blocks.keys())
+    worklist = sorted(priority[node] for node in dirty)  # Already a heap.
+    pending = bytearray(graph.n)
+    for node in dirty:
+        pending[node] = 1
+    last = len(order)
     while worklist:
-        node = worklist.pop(0)
+        i = heapq.heappop(worklist)
+        node = order[i]
+        pending[node] = 0
+        if stats is not None:
+            stats.transfers += 1
+            if i <= last:
+                stats.iterations += 1
+        last = i
 
-        inval = analysis.merge(out[n] for n in in_edges[node])
+        inval = analysis.merge(out[n] for n in in_edges(node))
         in_[node] = inval
 
-        outval = analysis.transfer(blocks[node], inval)
+        outval = analysis.transfer(values[node], inval)
 
         if outval != out[node]:
             out[node] = outval
-            worklist += out_edges[node]
+            for n in out_edges(node):
+                if not pending[n]:
+                    pending[n] = 1
+                    heapq.heappush(worklist, priority[n])
 
+    in_ = dict(zip(names, in_))
+    out = dict(zip(names, out))
     if analysis.forward:
         return in_, out
     else:
         return out, in_
 
 
+# A bit-vector analysis is a "gen/kill" problem over sets of variables:
+# - forward: True for forward, False for backward.
+# - gen: Get the set of variables a block generates.
+# - kill: Get the set of variables a block kills.
+# Instead of functions, gen and kill may be maps from block names to sets.
+# - may: True to merge with union, False to merge with intersection.
+# The transfer function is always `gen(b) | (x - kill(b))`.
+BitAnalysis = namedtuple('BitAnalysis', ['forward', 'gen', 'kill', 'may'])
+
+
+def _bits_to_set(bits, names):
+    out = set()
+    while bits:
+        low = bits & -bits
+        out.add(names[low.bit_length() - 1])
+        bits ^= low
+    return out
+
+
+def _per_block(sets, blocks):
+    if isinstance(sets, dict):
+        return sets
+    return {name: sets(block) for name, block in blocks.items()}
+
+
+class _BitProblem:
+    """A `BitAnalysis` of a specific function, translated to an
+    `Analysis` over integers.
+
+    Each variable in the function gets a bit, and each block's gen and
+    kill sets are converted to masks once up front, so every transfer
+    is just two bitwise operations.
+    """
+
+    def __init__(self, blocks, analysis):
+        # Number the variables.
+        gens = _per_block(analysis.gen, blocks)
+        kills = _per_block(analysis.kill, blocks)
+        self.names = sorted(union(gens.values()) | union(kills.values()))
+        self.index = {var: i for i, var in enumerate(self.names)}
+        full = (1 << len(self.names)) - 1
+
+        # Each "block" becomes a (gen, keep) pair of masks.
+        self.masks = {name: (self.encode(gens[name]),
+                             full & ~self.encode(kills[name]))
+                      for name in blocks}
+
+        if analysis.may:
+            def merge(vals):
+                out = 0
+                for v in vals:
+                    out |= v
+                return out
+        else:
+            def merge(vals):
+                out = None
+                for v in vals:
+                    out = v if out is None else out & v
+                return out or 0  # Nothing flows in at the boundary.
+
+        self.analysis = Analysis(
+            analysis.forward,
+            init=0 if analysis.may else full,
+            merge=merge,
+            transfer=lambda gk, x: gk[0] | (x & gk[1]),
+        )
+
+    def encode(self, vars):
+        bits = 0
+        for var in vars:
+            bits |= 1 << self.index[var]
+        return bits
+
+    def encode_map(self, vals):
+        return {name: self.encode(v) for name, v in vals.items()}
+
+    def decode_map(self, vals):
+        return {name: _bits_to_set(bits, self.names)
+                for name, bits in vals.items()}
+
+
+def df_bitvector(blocks, analysis, stats=None, graph=None):
+    """Solve a `BitAnalysis` by representing sets of variables as
+    integers. The results are converted back to sets, so they look just
+    like the results of `df_worklist`.
+    """
+    if graph is None:
+        graph = cfg.CFG(blocks)
+    prob = _BitProblem(blocks, analysis)
+    in_, out = _solve(prob.masks, graph, prob.analysis, stats)
+    return prob.decode_map(in_), prob.decode_map(out)
+
+
+def solve(blocks, analysis, stats=None, graph=None):
+    """Solve any analysis, with the bit-vector solver if possible. Pass
+    the function's `cfg.CFG` as `graph` if it is already built.
+    """
+    if isinstance(analysis, BitAnalysis):
+        return df_bitvector(blocks, analysis, stats, graph)
+    else:
+        return df_worklist(blocks, analysis, stats, graph)
+
+
+def solve_incremental(blocks, analysis, in_, out, modified, stats=None):
+    """Update a solution `(in_, out)` after some blocks change, and
+    return the new solution.
+
+    `modified` must contain every block whose instructions changed,
+    every new block, and (if the edges of the CFG changed) every block
+    that gained or lost an edge. Only the blocks that depend on these
+    are solved again, and the result is the same as solving from
+    scratch.
+    """
+    graph = cfg.CFG(blocks)
+    if isinstance(analysis, BitAnalysis):
+        prob = _BitProblem(blocks, analysis)
+        # Old facts about dirty blocks may mention variables that no
+        # longer exist, and they are not used anyway.
+        dirty = _reachable(
+            (graph.index[name] for name in modified),
+            graph.succs if analysis.forward else graph.preds,
+        )
+        keep = [name for i, name in enumerate(graph.names)
+                if i not in dirty]
+        in_, out = _solve(prob.masks, graph, prob.analysis, stats, (
+            prob.encode_map({name: in_[name] for name in keep}),
+            prob.encode_map({name: out[name] for name in keep}),
+        ), modified)
+        return prob.decode_map(in_), prob.decode_map(out)
+    else:
+        return _solve(blocks, graph, analysis, stats, (in_, out), modified)
+
+
 def fmt(val):
     """Guess a good way to format a data flow value. (Works for sets and
     dicts, at least.)
@@ -79,17 +313,34 @@ def fmt(val):
         return str(val)
 
 
-def run_df(bril, analysis):
+def run_df(bril, analysis, show_stats=False, incremental=False):
+    """Solve and print an analysis for every function.
+
+    With `incremental`, solve it, then delete the locally killed
+    instructions in every block (like `tdce.py dkp`) and update the
+    solution with `solve_incremental`, checking that the result is the
+    same as solving from scratch.
+    """
     for func in bril['functions']:
         # Form the CFG.
         blocks = cfg.block_map(form_blocks(func['instrs']))
         cfg.add_terminators(blocks)
 
-        in_, out = df_worklist(blocks, analysis)
+        stats = SolverStats()
+        in_, out = solve(blocks, analysis, stats)
+        if incremental:
+            modified = {name for name, block in blocks.items()
+                        if drop_killed_local(block)}
+            in_, out = solve_incremental(blocks, analysis, in_, out,
+                                         modified, stats)
+            assert (in_, out) == solve(blocks, analysis), \
+                'incremental solution differs from a fresh one'
         for block in blocks:
             print('{}:'.format(block))
             print('  in: ', fmt(in_[block]))
             print('  out:', fmt(out[block]))
+        if show_stats:
+            print('@{}: {}'.format(func['name'], stats), file=sys.stderr)
 
 
 def gen(block):
@@ -139,20 +390,20 @@ def cprop_merge(vals_list):
 ANALYSES = {
     # A really really basic analysis that just accumulates all the
     # currently-defined variables.
-    'defined': Analysis(
+    'defined': BitAnalysis(
         True,
-        init=set(),
-        merge=union,
-        transfer=lambda block, in_: in_.union(gen(block)),
+        gen=gen,
+        kill=lambda block: set(),
+        may=True,
     ),
 
     # Live variable analysis: the variables that are both defined at a
     # given point and might be read along some path in the future.
-    'live': Analysis(
+    'live': BitAnalysis(
         False,
-        init=set(),
-        merge=union,
-        transfer=lambda block, out: use(block).union(out - gen(block)),
+        gen=use,
+        kill=gen,
+        may=True,
     ),
 
     # A simple constant propagation pass.
@@ -165,5 +416,7 @@ ANALYSES = {
 }
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
-    run_df(bril, ANALYSES[sys.argv[1]])
+    bril = load(sys.stdin)
+    run_df(bril, ANALYSES[sys.argv[1]],
+           show_stats='--stats' in sys.argv[2:],
+           incremental='--incremental' in sys.argv[2:])
@@ -1,8 +1,10 @@
 import json
 import sys
+from collections import defaultdict
 
 from cfg import block_map, successors, add_terminators, add_entry
 from form_blocks import form_blocks
+from util import load
 
 
 def map_inv(succ):
@@ -21,14 +23,24 @@ def map_inv(succ):
 def postorder_helper(succ, root, explored, out):
     """Given a successor edge map, produce a list of all the nodes in
     the graph in postorder by appending to the `out` list.
+
+    This uses an explicit stack, so it works on arbitrarily deep graphs.
     """
     if root in explored:
         return
     explored.add(root)
 
-    for s in succ[root]:
-        postorder_helper(succ, s, explored, out)
-    out.append(root)
+    stack = [(root, iter(succ[root]))]
+    while stack:
+        node, it = stack[-1]
+        for s in it:
+            if s not in explored:
+                explored.add(s)
+                stack.append((s, iter(succ[s])))
+                break
+        else:
+            stack.pop()
+            out.append(node)
 
 
 def postorder(succ, root):
@@ -47,77 +59,304 @@ def intersect(sets):
     return out
 
 
-def get_dom(succ, entry):
+def _idom_chk(succ, entry):
+    """The "engineered" iterative algorithm from Cooper, Harvey, and
+    Kennedy's "A Simple, Fast Dominance Algorithm."
+    """
     pred = map_inv(succ)
     nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
+    number = {v: i for i, v in enumerate(nodes)}
+
+    def common(a, b):
+        # Walk up the tree (toward smaller numbers) until the fingers
+        # meet.
+        while a != b:
+            while number[a] > number[b]:
+                a = idom[a]
+            while number[b] > number[a]:
+                b = idom[b]
+        return a
+
+    idom = {entry: entry}
+    changed = True
+    while changed:
+        changed = False
+        for node in nodes[1:]:
+            new_idom = None
+            for p in pred[node]:
+                if p in idom:  # Processed already (and reachable).
+                    new_idom = p if new_idom is None else common(p, new_idom)
+            if idom.get(node) != new_idom:
+                idom[node] = new_idom
+                changed = True
 
-    dom = {v: set(nodes) for v in succ}
+    idom[entry] = None
+    return idom
 
-    while True:
-        changed = False
 
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
+def _idom_lt(succ, entry):
+    """The Lengauer-Tarjan algorithm, with simple path compression.
+    """
+    pred = map_inv(succ)
 
-            if dom[node] != new_dom:
-                dom[node] = new_dom
-                changed = True
+    # Number the nodes in depth-first preorder.
+    vertex = [entry]
+    semi = {entry: 0}
+    parent = {}
+    stack = [(entry, iter(succ[entry]))]
+    while stack:
+        node, it = stack[-1]
+        for s in it:
+            if s not in semi:
+                semi[s] = len(vertex)
+                vertex.append(s)
+                parent[s] = node
+                stack.append((s, iter(succ[s])))
+                break
+        else:
+            stack.pop()
+
+    ancestor = {}
+    label = {v: v for v in vertex}
+
+    def compress(v):
+        path = []
+        while ancestor[v] in ancestor:
+            path.append(v)
+            v = ancestor[v]
+        for v in reversed(path):
+            a = ancestor[v]
+            if semi[label[a]] < semi[label[v]]:
+                label[v] = label[a]
+            ancestor[v] = ancestor[a]
+
+    def eval_(v):
+        if v not in ancestor:
+            return v
+        compress(v)
+        return label[v]
+
+    idom = {}
+    bucket = defaultdict(list)
+    for w in reversed(vertex[1:]):
+        for v in pred[w]:
+            if v in semi:  # Skip unreachable predecessors.
+                u = eval_(v)
+                if semi[u] < semi[w]:
+                    semi[w] = semi[u]
+        bucket[vertex[semi[w]]].append(w)
+        ancestor[w] = parent[w]
+
+        for v in bucket.pop(parent[w], []):
+            u = eval_(v)
+            idom[v] = u if semi[u] < semi[v] else parent[w]
+
+    for w in vertex[1:]:
+        if idom[w] != vertex[semi[w]]:
+            idom[w] = idom[idom[w]]
+
+    idom[entry] = None
+    return idom
+
+
+IDOM_METHODS = {
+    'chk': _idom_chk,
+    'lt': _idom_lt,
+}
+
+
+def get_idom(succ, entry, method='chk'):
+    """Compute the immediate dominator of every node reachable from
+    `entry`, as a map from nodes to their immediate dominators. The
+    entry maps to None, and unreachable nodes are left out.
+
+    `method` is `chk` for the Cooper-Harvey-Kennedy algorithm or `lt`
+    for Lengauer-Tarjan.
+    """
+    return IDOM_METHODS[method](succ, entry)
+
+
+def get_dom(succ, entry, method='chk'):
+    """Compute the set of dominators of every node.
+    """
+    return idom_dom(get_idom(succ, entry, method), succ)
 
-        if not changed:
-            break
 
+def idom_dom(idom, succ):
+    """Expand the immediate dominators into the full dominance relation,
+    as a map from every node to the set of its dominators.
+
+    Nodes that are unreachable from the entry are "dominated" by every
+    reachable node.
+    """
+    tree = idom_tree(idom)
+    entry = next(node for node, parent in idom.items() if parent is None)
+    dom = {}
+    for node in reversed(postorder(tree, entry)):
+        parent = idom[node]
+        dom[node] = (set() if parent is None else set(dom[parent])) | {node}
+    for node in succ:
+        if node not in dom:
+            dom[node] = set(idom)
     return dom
 
 
-def dom_fronts(dom, succ):
-    """Compute the dominance frontier, given the dominance relation.
+def idom_of_dom(dom):
+    """Recover the immediate dominators from a full dominance relation.
+
+    A node's immediate dominator is the strict dominator that has
+    exactly one fewer dominator than it does.
+    """
+    idom = {}
+    for node, doms in dom.items():
+        if node not in doms:
+            continue  # Unreachable.
+        idom[node] = None
+        for d in doms:
+            if len(dom[d]) == len(doms) - 1:
+                idom[node] = d
+                break
+    return idom
+
+
+def idom_tree(idom, nodes=()):
+    """Get the dominator tree, as a map from nodes to their children,
+    from the immediate dominators. Any extra `nodes` (like unreachable
+    ones) get an empty entry.
     """
-    dom_inv = map_inv(dom)
+    tree = {node: set() for node in nodes}
+    tree.update((node, set()) for node in idom)
+    for node, parent in idom.items():
+        if parent is not None:
+            tree[parent].add(node)
+    return tree
 
-    frontiers = {}
-    for block in dom:
-        # Find all successors of dominated blocks.
-        dominated_succs = set()
-        for dominated in dom_inv[block]:
-            dominated_succs.update(succ[dominated])
 
-        # You're in the frontier if you're not strictly dominated by the
-        # current block.
-        frontiers[block] = [b for b in dominated_succs
-                            if b not in dom_inv[block] or b == block]
+def idom_fronts(idom, succ):
+    """Compute the dominance frontiers from the immediate dominators,
+    bottom-up over the dominator tree (like Cytron et al.):
 
+        DF(x) = {y in succ(x) | idom(y) != x}
+              + {y in DF(z) | z is a child of x, idom(y) != x}
+    """
+    tree = idom_tree(idom)
+    entry = next(node for node, parent in idom.items() if parent is None)
+
+    frontiers = {node: [] for node in succ}
+    for node in postorder(tree, entry):
+        front = {s for s in succ[node] if s in idom and idom[s] != node}
+        for child in tree[node]:
+            front.update(y for y in frontiers[child] if idom[y] != node)
+        frontiers[node] = list(front)
     return frontiers
 
 
+class Dominance:
+    """Answer dominance queries in constant time, using linear memory.
+
+    Number the nodes of the dominator tree in depth-first preorder and
+    postorder. Then `a` dominates `b` exactly when `b`'s numbers both
+    fall within `a`'s interval. The answers agree with `get_dom`, so
+    unreachable nodes are dominated by every reachable node.
+    """
+
+    def __init__(self, idom):
+        self.idom = idom
+        self.pre = {}
+        self.post = {}
+        tree = idom_tree(idom)
+        entry = next(node for node, parent in idom.items() if parent is None)
+
+        self.pre[entry] = 0
+        stack = [(entry, iter(tree[entry]))]
+        while stack:
+            node, it = stack[-1]
+            for child in it:
+                self.pre[child] = len(self.pre)
+                stack.append((child, iter(tree[child])))
+                break
+            else:
+                stack.pop()
+                self.post[node] = len(self.post)
+
+    def dominates(self, a, b):
+        if b not in self.pre:
+            return a in self.pre  # Unreachable.
+        return (a in self.pre and self.pre[a] <= self.pre[b] and
+                self.post[b] <= self.post[a])
+
+    def strictly_dominates(self, a, b):
+        return a != b and self.dominates(a, b)
+
+    def nearest_common_dominator(self, a, b):
+        """Find the closest node that dominates both `a` and `b`, by
+        walking up the tree from `a` (so this takes time proportional to
+        its depth). Return None if neither is reachable.
+        """
+        if a not in self.pre:
+            return b if b in self.pre else None
+        while not self.dominates(a, b):
+            a = self.idom[a]
+        return a
+
+
+def dom_fronts(dom, succ):
+    """Compute the dominance frontier, given the dominance relation.
+    """
+    return idom_fronts(idom_of_dom(dom), succ)
+
+
 def dom_tree(dom):
-    # Get the blocks strictly dominated by a block strictly dominated by
-    # a given block.
-    dom_inv = map_inv(dom)
-    dom_inv_strict = {a: {b for b in bs if b != a}
-                      for a, bs in dom_inv.items()}
-    dom_inv_strict_2x = {a: set().union(*(dom_inv_strict[b] for b in bs))
-                         for a, bs in dom_inv_strict.items()}
-    return {
-        a: {b for b in bs if b not in dom_inv_strict_2x[a]}
-        for a, bs in dom_inv_strict.items()
-    }
-
-
-def print_dom(bril, mode):
+    """Get the dominator tree, as a map from nodes to the nodes they
+    immediately dominate, given the dominance relation.
+    """
+    return idom_tree(idom_of_dom(dom), dom)
+
+
+def check_dominance(dominance, dom):
+    """Check that the answers from a `Dominance` agree with the
+    dominator sets from `get_dom` for every pair of nodes, and print the
+    nearest common dominator of each pair.
+    """
+    for a in sorted(dom):
+        for b in sorted(dom):
+            assert dominance.dominates(a, b) == (a in dom[b]), (a, b)
+            assert dominance.strictly_dominates(a, b) == \
+                (a in dom[b] and a != b), (a, b)
+
+            # The nearest common dominator is the common dominator that
+            # all the others dominate.
+            common = dom[a] & dom[b]
+            ncd = dominance.nearest_common_dominator(a, b)
+            if a not in dom[a] and b not in dom[b]:
+                assert ncd is None, (a, b)
+            else:
+                assert ncd in common, (a, b)
+                assert all(d in dom[ncd] for d in common), (a, b)
+            if a < b:
+                print('{} {}: {}'.format(a, b, ncd))
+
+
+def print_dom(bril, mode, method='chk'):
     for func in bril['functions']:
         blocks = block_map(form_blocks(func['instrs']))
         add_entry(blocks)
         add_terminators(blocks)
         succ = {name: successors(block[-1]) for name, block in blocks.items()}
-        dom = get_dom(succ, list(blocks.keys())[0])
-
-        if mode == 'front':
-            res = dom_fronts(dom, succ)
+        entry = list(blocks.keys())[0]
+        idom = get_idom(succ, entry, method)
+
+        if mode == 'check':
+            check_dominance(Dominance(idom), get_dom(succ, entry, method))
+            continue
+        elif mode == 'front':
+            res = idom_fronts(idom, succ)
         elif mode == 'tree':
-            res = dom_tree(dom)
+            res = idom_tree(idom, succ)
+        elif mode == 'idom':
+            res = {k: [] if v is None else [v] for k, v in idom.items()}
         else:
-            res = dom
+            res = get_dom(succ, entry, method)
 
         # Format as JSON for stable output.
         print(json.dumps(
@@ -127,7 +366,9 @@ def print_dom(bril, mode):
 
 
 if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if a != '--lt']
     print_dom(
-        json.load(sys.stdin),
-        'dom' if len(sys.argv) < 2 else sys.argv[1]
+        load(sys.stdin),
+        'dom' if not args else args[0],
+        'lt' if '--lt' in sys.argv[1:] else 'chk',
     )
@@ -1,8 +1,8 @@
 """Create and print out the basic blocks in a Bril function.
 """
 
-import json
 import sys
+from util import load
 
 # Instructions that terminate a basic block.
 TERMINATORS = 'br', 'jmp', 'ret'
@@ -68,4 +68,4 @@ def print_blocks(bril):
 
 
 if __name__ == '__main__':
-    print_blocks(json.load(sys.stdin))
+    print_blocks(load(sys.stdin))
@@ -1,14 +1,35 @@
+"""Convert functions out of SSA form.
+
+By default, replace every phi-node with one copy in each predecessor.
+With `--coalesce`, first merge each phi-node's destination with as many
+of its arguments as possible (when they do not interfere), so they can
+share a single variable. Copies are only needed for the arguments that
+remain, and they are placed on the CFG edges they belong to, splitting
+critical edges only when a copy at the end of the predecessor would be
+visible on another path.
+"""
+
 import json
 import sys
+from collections import Counter, OrderedDict, defaultdict
+
+from cfg import reassemble
+from analyses import AnalysisManager, BLOCKS, CONTROL_FLOW
+from df import BitAnalysis, solve
+from util import fresh, fresh_names, load
 
-from cfg import block_map, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
+UNDEFINED = '__undefined'
 
 
-def func_from_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
+def func_from_ssa(func, am=None, coalesce=False):
+    """Convert a function out of SSA form, using (and updating) the
+    analyses cached in `am`, if given.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    if coalesce:
+        return coalesce_from_ssa(func, am)
+    blocks = am['cfg']
 
     # Replace each phi-node.
     for block in blocks.values():
@@ -19,6 +40,8 @@ def func_from_ssa(func):
                 type = instr['type']
                 for i, label in enumerate(instr['labels']):
                     var = instr['args'][i]
+                    if var == UNDEFINED:
+                        continue  # No value along this edge.
 
                     # Insert a copy in the predecessor block, before the
                     # terminator.
@@ -35,13 +58,242 @@ def func_from_ssa(func):
         block[:] = new_block
 
     func['instrs'] = reassemble(blocks)
+    am.invalidate(CONTROL_FLOW | BLOCKS)
+
+
+def phi_liveness(blocks, phis):
+    """Compute live variables, treating phi-node arguments as uses at the
+    end of the corresponding predecessor (not at the phi-node itself).
+
+    Return maps from block names to the variables live at their entry
+    (not counting their own phi-node destinations) and exit (counting
+    the arguments to their successors' phi-nodes).
+    """
+    # Phi-node arguments read at the end of each block.
+    edge_uses = defaultdict(set)
+    for phi in (p for ps in phis.values() for p in ps):
+        for label, arg in zip(phi['labels'], phi['args']):
+            if arg != UNDEFINED:
+                edge_uses[label].add(arg)
+
+    gen = {}
+    kill = {}
+    for name, block in blocks.items():
+        defined = set()
+        used = set()
+        for instr in block:
+            if instr.get('op') != 'phi':
+                used.update(v for v in instr.get('args', [])
+                            if v not in defined)
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+        gen[name] = used | (edge_uses[name] - defined)
+        kill[name] = defined
+
+    live_in, live_out = solve(blocks, BitAnalysis(False, gen, kill, True))
+    return live_in, {name: live_out[name] | edge_uses[name]
+                     for name in blocks}
+
+
+def interference(blocks, phis, live_out, candidates, args):
+    """Find which of the `candidates` interfere: one of them is defined
+    while the other is live.
+
+    All the phi-node destinations in a block are defined at once, and so
+    are the function arguments.
+    """
+    interf = defaultdict(set)
+    entry = next(iter(blocks), None)
+
+    def define(dests, live):
+        for d in dests:
+            if d in candidates:
+                for v in live:
+                    if v != d and v in candidates:
+                        interf[d].add(v)
+                        interf[v].add(d)
+
+    for name, block in blocks.items():
+        live = set(live_out[name])
+        for instr in reversed(block):
+            if instr.get('op') == 'phi':
+                continue
+            if 'dest' in instr:
+                define([instr['dest']], live)
+                live.discard(instr['dest'])
+            live.update(instr.get('args', []))
+
+        dests = [phi['dest'] for phi in phis[name]]
+        define(dests, live | set(dests))
+        live.difference_update(dests)
+        if name == entry:
+            define(args, live | set(args))
+
+    return interf
+
+
+def sequentialize(copies, temps):
+    """Turn a parallel copy, given as a list of distinct (dest, source)
+    pairs, into a list of sequential copies with the same effect.
+
+    Cycles are broken with a temporary variable from the `temps`
+    iterator, which is mentioned as a dest of the returned copies.
+    """
+    pending = {d: s for d, s in copies if d != s}
+    readers = Counter(pending.values())
+    ready = [d for d in pending if not readers[d]]
+    out = []
+    while pending:
+        # Emit every copy whose destination is no longer needed.
+        while ready:
+            d = ready.pop()
+            s = pending.pop(d)
+            out.append((d, s))
+            readers[s] -= 1
+            if not readers[s] and s in pending:
+                ready.append(s)
+
+        # Only cycles remain. Save one destination to a temporary.
+        if pending:
+            d = next(iter(pending))
+            tmp = next(temps)
+            out.append((tmp, d))
+            for dest, src in pending.items():
+                if src == d:
+                    pending[dest] = tmp
+            readers[d] = 0
+            ready.append(d)
+    return out
+
+
+def coalesce_from_ssa(func, am):
+    """Convert a function out of SSA form, coalescing variables that are
+    connected through phi-nodes when they do not interfere.
+    """
+    blocks = am['cfg']
+    succ = am['succ']
+    pred = am['pred']
+    arg_names = [a['name'] for a in func.get('args', [])]
+
+    phis = {name: [i for i in block if i.get('op') == 'phi']
+            for name, block in blocks.items()}
+    live_in, live_out = phi_liveness(blocks, phis)
+
+    types = {a['name']: a['type'] for a in func.get('args', [])}
+    for block in blocks.values():
+        for instr in block:
+            if 'dest' in instr:
+                types[instr['dest']] = instr['type']
+
+    # Group phi-node destinations and arguments into classes of variables
+    # that do not interfere.
+    candidates = set()
+    for phi in (p for ps in phis.values() for p in ps):
+        candidates.add(phi['dest'])
+        candidates.update(a for a in phi['args'] if a != UNDEFINED)
+    interf = interference(blocks, phis, live_out, candidates, arg_names)
+
+    members = {v: [v] for v in candidates}
+    rep = {v: v for v in candidates}
+    for phi in (p for ps in phis.values() for p in ps):
+        for arg in phi['args']:
+            a, b = rep.get(arg), rep[phi['dest']]
+            if a is None or a == b:
+                continue
+            if any(interf[m].intersection(members[b]) for m in members[a]):
+                continue
+            if b in arg_names or (a not in arg_names and
+                                  len(members[b]) > len(members[a])):
+                a, b = b, a
+            # Merge class b into a.
+            for m in members[b]:
+                rep[m] = a
+            members[a] += members.pop(b)
+
+    def name(var):
+        return rep.get(var, var)
+
+    # Parallel copies for each edge.
+    copies = defaultdict(list)
+    for s, ps in phis.items():
+        for phi in ps:
+            for label, arg in zip(phi['labels'], phi['args']):
+                if arg != UNDEFINED and name(arg) != name(phi['dest']):
+                    copies[label, s].append((name(phi['dest']), name(arg)))
+
+    def clobbers(dests, p, s):
+        """Would copies to `dests` at the end of `p` be visible on another
+        edge out of `p` than the one to `s`?
+        """
+        if any(name(v) in dests for v in p_term[p]):
+            return True
+        for t in succ[p]:
+            if t == s:
+                continue
+            if (p, t) in copies:
+                return True
+            if any(name(v) in dests for v in live_in[t]):
+                return True
+            for phi in phis[t]:
+                for label, arg in zip(phi['labels'], phi['args']):
+                    if label == p and name(arg) in dests:
+                        return True
+        return False
+
+    # Remove the phi-nodes and rename everything to its class's name.
+    for block in blocks.values():
+        block[:] = [i for i in block if i.get('op') != 'phi']
+        for instr in block:
+            if 'args' in instr:
+                instr['args'] = [name(a) for a in instr['args']]
+            if 'dest' in instr:
+                instr['dest'] = name(instr['dest'])
+    p_term = {p: block[-1].get('args', []) for p, block in blocks.items()}
+
+    # Place the copies, splitting critical edges where needed.
+    all_vars = set(types) | set(blocks)
+    temps = fresh_names('tmp', all_vars)
+    splits = defaultdict(list)
+    for (p, s), pcopy in copies.items():
+        seq = []
+        for d, v in sequentialize(pcopy, temps):
+            types.setdefault(d, types[v])
+            seq.append({'op': 'id', 'dest': d, 'type': types[v], 'args': [v]})
+
+        dests = {d for d, _ in pcopy}
+        if len(succ[p]) == 1:
+            blocks[p][-1:-1] = seq
+        elif len(pred[s]) == 1:
+            blocks[s][0:0] = seq
+        elif not clobbers(dests, p, s):
+            blocks[p][-1:-1] = seq
+        else:
+            label = fresh('{}.{}.'.format(p, s), all_vars)
+            all_vars.add(label)
+            term = blocks[p][-1]
+            term['labels'] = [label if lbl == s else lbl
+                              for lbl in term['labels']]
+            splits[p].append((label, seq + [{'op': 'jmp', 'labels': [s]}]))
+
+    # Put each new block right after the one it came from.
+    new_blocks = OrderedDict()
+    for p, block in blocks.items():
+        new_blocks[p] = block
+        for label, block in splits[p]:
+            new_blocks[label] = block
+
+    for a in func.get('args', []):
+        a['name'] = name(a['name'])
+    func['instrs'] = reassemble(new_blocks)
+    am.invalidate()
 
 
-def from_ssa(bril):
+def from_ssa(bril, coalesce=False):
     for func in bril['functions']:
-        func_from_ssa(func)
+        func_from_ssa(func, coalesce=coalesce)
     return bril
 
 
 if __name__ == '__main__':
-    print(json.dumps(from_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    bril = from_ssa(load(sys.stdin), '--coalesce' in sys.argv[1:])
+    print(json.dumps(bril, indent=2, sort_keys=True))
@@ -0,0 +1,185 @@
+"""Global value numbering for Bril programs in SSA form.
+
+This extends local value numbering (see `lvn.py`) to whole functions by
+walking the dominator tree. The table of available values is scoped: a
+block sees the values computed in the blocks that dominate it, and they
+are forgotten when the walk leaves the block's subtree. Because every
+variable is assigned once, the mapping from variables to value numbers
+never needs to be forgotten.
+
+Phi-nodes whose arguments all have the same value, and phi-nodes that
+duplicate another one in the same block, are removed as well. Run
+`tdce.py` afterward to clean up the copies this leaves behind.
+"""
+import json
+import sys
+
+from analyses import AnalysisManager, BLOCKS, CONTROL_FLOW
+from cfg import reassemble
+from dom import postorder
+from lvn import Value, Numbering, _lookup, _canonicalize, _fold
+from util import load
+
+# Value operations that cannot be replaced with an earlier computation
+# of the same value, because they have side effects or read memory.
+IMPURE_OPS = {'call', 'alloc', 'load'}
+
+
+def _number_phi(instr, block, var2num, num2var, num2const, value2num,
+                scope):
+    """Give a phi-node a value number, and return whether it is
+    redundant (so it can be removed). A phi-node whose arguments are all
+    the same constant becomes a `const` instruction instead, which is
+    numbered along with the rest of the block.
+    """
+    argnums = tuple(var2num.get(a) for a in instr['args'])
+    if None not in argnums:
+        if len(set(argnums)) == 1:
+            # All arguments have the same value.
+            var2num[instr['dest']] = argnums[0]
+            return True
+        consts = [num2const.get(n) for n in argnums]
+        if all(n in num2const for n in argnums) and \
+                all(c == consts[0] for c in consts):
+            instr.update({'op': 'const', 'value': consts[0]})
+            del instr['args']
+            del instr['labels']
+            return False
+        val = Value('phi', (block,) + tuple(sorted(zip(instr['labels'],
+                                                       argnums))))
+        if val in value2num:
+            var2num[instr['dest']] = value2num[val]
+            return True
+    else:
+        val = None
+
+    num = var2num.add(instr['dest'])
+    num2var[num] = instr['dest']
+    if val is not None:
+        value2num[val] = num
+        scope.append(val)
+    return False
+
+
+def gvn_block(block, name, var2num, num2var, num2const, value2num, scope):
+    """Use value numbering to optimize a block, given the tables
+    computed for its dominators. Modify the instructions in place, and
+    record every value added to `value2num` in `scope`.
+    """
+    block[:] = [i for i in block if not (
+        i.get('op') == 'phi' and
+        _number_phi(i, name, var2num, num2var, num2const, value2num,
+                    scope)
+    )]
+
+    for instr in block:
+        if instr.get('op') == 'phi':
+            continue
+        for arg in instr.get('args', []):
+            if arg not in var2num:
+                # A variable that may be undefined is its own value.
+                num2var[var2num.add(arg)] = arg
+        argnums = tuple(var2num[a] for a in instr.get('args', []))
+
+        val = None
+        if instr.get('op') == 'const':
+            val = Value('const', (instr['type'], instr['value']))
+        elif 'dest' in instr and 'args' in instr and \
+                instr['op'] not in IMPURE_OPS:
+            val = _canonicalize(Value(instr['op'], argnums))
+
+        if val is not None:
+            # Is this value already available?
+            num = _lookup(value2num, val)
+            if num is not None:
+                var2num[instr['dest']] = num
+                if num in num2const:
+                    instr.update({'op': 'const', 'value': num2const[num]})
+                    instr.pop('args', None)
+                else:
+                    instr.update({'op': 'id', 'args': [num2var[num]]})
+                continue
+
+        if 'dest' in instr:
+            num = var2num.add(instr['dest'])
+            num2var[num] = instr['dest']
+            if val is not None:
+                if val.op == 'const':
+                    num2const[num] = instr['value']
+                else:
+                    const = _fold(num2const, val)
+                    if const is not None:
+                        num2const[num] = const
+                        instr.update({'op': 'const', 'value': const})
+                        del instr['args']
+                        continue
+                value2num[val] = num
+                scope.append(val)
+
+        # Use the canonical variable for each argument.
+        if 'args' in instr:
+            instr['args'] = [num2var[n] for n in argnums]
+
+
+def gvn_func(func, am=None):
+    """Apply global value numbering to a function in SSA form.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    blocks = am['cfg']
+    succ = am['succ']
+    domtree = am['dom_tree']
+
+    var2num = Numbering()
+    num2var = {}
+    num2const = {}
+    value2num = {}
+    for arg in func.get('args', []):
+        num = var2num.add(arg['name'])
+        num2var[num] = arg['name']
+
+    # Walk the dominator tree, visiting children in reverse postorder so
+    # that (except along back edges) a block's predecessors come first,
+    # and undoing each block's additions to the value table when leaving
+    # its subtree.
+    entry = next(iter(blocks))
+    order = {b: i for i, b in enumerate(postorder(succ, entry))}
+    stack = [(entry, None)]
+    while stack:
+        name, scope = stack.pop()
+        if scope is not None:
+            for val in scope:
+                del value2num[val]
+            continue
+
+        scope = []
+        gvn_block(blocks[name], name, var2num, num2var, num2const,
+                  value2num, scope)
+
+        # Use the canonical variables in successors' phi-nodes.
+        for s in succ[name]:
+            for instr in blocks[s]:
+                if instr.get('op') == 'phi':
+                    instr['args'] = [
+                        num2var[var2num[a]]
+                        if label == name and a in var2num else a
+                        for a, label in zip(instr['args'], instr['labels'])
+                    ]
+
+        stack.append((name, scope))
+        for child in sorted(domtree[name], key=order.get):
+            stack.append((child, None))
+
+    func['instrs'] = reassemble(blocks)
+    am.invalidate(CONTROL_FLOW | BLOCKS)
+
+
+def gvn(bril):
+    for func in bril['functions']:
+        gvn_func(func)
+    return bril
+
+
+if __name__ == '__main__':
+    bril = gvn(load(sys.stdin))
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,260 @@
+"""Inline function calls in Bril programs.
+
+The pass builds the program's call graph, splits it into strongly
+connected components (sets of mutually recursive functions), and visits
+the functions bottom-up, callees before callers. So by the time a call
+is inlined, the callee's own calls have already been inlined into it
+where possible.
+
+A call is inlined when the callee has at most `budget` instructions (by
+default `BUDGET`, or the number given as the first argument). With
+`--stats`, print the number of calls inlined into each function and the
+program's final size in instructions to stderr. A call to
+a function in the same component, like a recursive call, inlines the
+callee's body as it was before any inlining, so recursion is unrolled by
+one level and the calls in the inlined copy stay calls.
+
+The inlined body gets fresh names for all its variables and labels. An
+argument is passed by using the caller's variable directly, unless the
+callee assigns to the parameter, in which case it is copied. Returns
+become jumps to the code after the call, and the returned value is
+copied into the call's destination, or assigned to it directly when the
+callee always returns the same variable. Functions that are no longer
+called (other than `main`) are deleted afterward.
+
+Functions in SSA form are left alone, since splitting a block would
+invalidate the labels of phi-nodes.
+"""
+import copy
+import json
+import sys
+from collections import OrderedDict
+
+from util import fresh, load
+
+# The largest function (in instructions) that gets inlined by default.
+BUDGET = 30
+
+
+def call_graph(bril):
+    """Map each function name to the names of the functions it calls,
+    in the order of their first call.
+    """
+    graph = OrderedDict()
+    for func in bril['functions']:
+        callees = graph.setdefault(func['name'], [])
+        for instr in func['instrs']:
+            if instr.get('op') == 'call':
+                for name in instr['funcs']:
+                    if name not in callees:
+                        callees.append(name)
+    return graph
+
+
+def sccs(graph):
+    """Find the strongly connected components of a graph with Tarjan's
+    algorithm. Return them as lists of nodes, in bottom-up order: every
+    component comes after the components it has edges to.
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    out = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            node, it = work[-1]
+            for s in it:
+                if s not in index:
+                    index[s] = low[s] = len(index)
+                    stack.append(s)
+                    on_stack.add(s)
+                    work.append((s, iter(graph[s])))
+                    break
+                elif s in on_stack:
+                    low[node] = min(low[node], index[s])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        n = stack.pop()
+                        on_stack.discard(n)
+                        component.append(n)
+                        if n == node:
+                            break
+                    out.append(component)
+    return out
+
+
+def size(instrs):
+    """Count the instructions (not labels) in a function body.
+    """
+    return sum(1 for i in instrs if 'op' in i)
+
+
+def _names(func):
+    """Get all the variable names and labels used in a function.
+    """
+    names = {a['name'] for a in func.get('args', [])}
+    for instr in func['instrs']:
+        names.update(instr.get('args', []))
+        names.update(instr.get('labels', []))
+        if 'dest' in instr:
+            names.add(instr['dest'])
+        if 'label' in instr:
+            names.add(instr['label'])
+    return names
+
+
+def inline_call(call, callee, body, names):
+    """Get the instructions that replace `call`, given the callee
+    function and the body to inline. Add the new names to `names`.
+    """
+    params = [a['name'] for a in callee.get('args', [])]
+    assigned = {i['dest'] for i in body if 'dest' in i}
+    dest = call.get('dest')
+
+    # Variables are renamed, and parameters that are never assigned
+    # become the caller's arguments.
+    rename = {}
+    code = []
+    for param, arg in zip(callee.get('args', []), call.get('args', [])):
+        if param['name'] in assigned:
+            new = fresh('{}.{}.'.format(callee['name'], param['name']), names)
+            names.add(new)
+            rename[param['name']] = new
+            code.append({'op': 'id', 'dest': new, 'type': param['type'],
+                         'args': [arg]})
+        else:
+            rename[param['name']] = arg
+
+    # If every return returns the same local variable, it can be the
+    # call's destination all along.
+    returned = {tuple(i.get('args', [])) for i in body
+                if i.get('op') == 'ret'}
+    direct = None
+    if dest is not None and len(returned) == 1:
+        var, = returned.pop() or (None,)
+        if var not in params + [None] and dest not in call.get('args', []):
+            direct = var
+            rename[var] = dest
+
+    for instr in body:
+        for var in instr.get('args', []) + [instr.get('dest')]:
+            if var is not None and var not in rename:
+                rename[var] = fresh('{}.{}.'.format(callee['name'], var),
+                                    names)
+                names.add(rename[var])
+    labels = {}
+    for instr in body:
+        for lbl in instr.get('labels', []) + [instr.get('label')]:
+            if lbl is not None and lbl not in labels:
+                labels[lbl] = fresh('{}.{}.'.format(callee['name'], lbl),
+                                    names)
+                names.add(labels[lbl])
+    after = fresh('{}.ret.'.format(callee['name']), names)
+    names.add(after)
+
+    for i, instr in enumerate(body):
+        if 'label' in instr:
+            code.append({'label': labels[instr['label']]})
+            continue
+        if instr['op'] == 'ret':
+            if instr.get('args') and dest is not None and direct is None:
+                code.append({'op': 'id', 'dest': dest, 'type': call['type'],
+                             'args': [rename[instr['args'][0]]]})
+            if i < len(body) - 1:
+                code.append({'op': 'jmp', 'labels': [after]})
+            continue
+        new = copy.deepcopy(instr)
+        if 'args' in new:
+            new['args'] = [rename[a] for a in new['args']]
+        if 'dest' in new:
+            new['dest'] = rename[new['dest']]
+        if 'labels' in new:
+            new['labels'] = [labels[lbl] for lbl in new['labels']]
+        code.append(new)
+    if any(after in i.get('labels', []) for i in code):
+        code.append({'label': after})
+    return code
+
+
+def inline_func(func, funcs, bodies, budget):
+    """Inline the calls in a function. `bodies` maps function names to
+    the bodies to inline for them: the original bodies for functions in
+    the same component, and the already optimized ones for the rest.
+    Return the number of calls inlined.
+    """
+    names = _names(func)
+    instrs = []
+    inlined = 0
+    for instr in func['instrs']:
+        callee = funcs.get(instr['funcs'][0]) \
+            if instr.get('op') == 'call' else None
+        if callee is None or size(bodies[callee['name']]) > budget or \
+                _is_ssa(bodies[callee['name']]):
+            instrs.append(instr)
+            continue
+        instrs += inline_call(instr, callee, bodies[callee['name']], names)
+        inlined += 1
+    func['instrs'] = instrs
+    return inlined
+
+
+def _is_ssa(instrs):
+    return any(i.get('op') == 'phi' for i in instrs)
+
+
+def inline(bril, budget=BUDGET, stats=False):
+    """Inline calls throughout a program, bottom-up over its call graph.
+    """
+    funcs = {func['name']: func for func in bril['functions']}
+    graph = call_graph(bril)
+    bodies = {}
+    for component in sccs(graph):
+        for name in component:
+            bodies[name] = copy.deepcopy(funcs[name]['instrs'])
+        for name in component:
+            if not _is_ssa(funcs[name]['instrs']):
+                n = inline_func(funcs[name], funcs, bodies, budget)
+                if stats:
+                    print('@{}: {} calls inlined'.format(name, n),
+                          file=sys.stderr)
+        for name in component:
+            bodies[name] = funcs[name]['instrs']
+
+    # Delete the functions that nothing calls anymore.
+    if 'main' in funcs:
+        graph = call_graph(bril)
+        called = {'main'}
+        stack = ['main']
+        while stack:
+            for callee in graph.get(stack.pop(), []):
+                if callee not in called:
+                    called.add(callee)
+                    stack.append(callee)
+        bril['functions'] = [f for f in bril['functions']
+                             if f['name'] in called]
+
+    if stats:
+        print('static_size: {}'.format(
+            sum(size(f['instrs']) for f in bril['functions'])
+        ), file=sys.stderr)
+    return bril
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if a != '--stats']
+    budget = int(args[0]) if args else BUDGET
+    bril = inline(load(sys.stdin), budget, '--stats' in sys.argv[1:])
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,231 @@
+"""A compact object model for Bril programs.
+
+The usual representation of a Bril program in these examples is its
+JSON data: every instruction is a dict. This module offers an
+alternative made of `__slots__` classes, which take much less memory per
+instruction and have a fixed set of fields, so passes can test
+`instr.dest is not None` instead of probing dict keys.
+
+Opcodes are interned as small integers: `Instr.op` is an index into
+`OPCODES`, and `OPCODE` maps names back to indices. Opcodes from
+extensions that are not in the table are added on first use.
+
+Conversion is lossless: `Program.from_json(data).to_json() == data`.
+List-valued fields are None when the key is absent in the JSON (which is
+different from an empty list), and keys that the model does not know
+about are kept in an `extra` dict. Run as a script, this module checks
+that the program on stdin survives the round trip and prints it again;
+the `turnt_ir.toml` tests under `test/` use that.
+"""
+
+import json
+import sys
+
+OPCODES = [
+    # Core.
+    'const', 'id', 'add', 'mul', 'sub', 'div',
+    'eq', 'lt', 'gt', 'le', 'ge', 'not', 'and', 'or',
+    'jmp', 'br', 'call', 'ret', 'print', 'nop',
+    # SSA.
+    'phi',
+    # Memory.
+    'alloc', 'free', 'store', 'load', 'ptradd',
+    # Floating point.
+    'fadd', 'fmul', 'fsub', 'fdiv', 'feq', 'flt', 'fle', 'fgt', 'fge',
+    # Speculation.
+    'speculate', 'commit', 'guard',
+]
+OPCODE = {name: i for i, name in enumerate(OPCODES)}
+
+
+def opcode(name):
+    """Get the number for an opcode, adding it to the table if needed.
+    """
+    try:
+        return OPCODE[name]
+    except KeyError:
+        OPCODE[name] = len(OPCODES)
+        OPCODES.append(name)
+        return OPCODE[name]
+
+
+def _intern_type(typ):
+    return sys.intern(typ) if isinstance(typ, str) else typ
+
+
+def _names(names):
+    return None if names is None else [sys.intern(n) for n in names]
+
+
+def _extra(data, known):
+    extra = {k: v for k, v in data.items() if k not in known}
+    return extra or None
+
+
+class Instr:
+    """A Bril instruction.
+    """
+    __slots__ = ('op', 'dest', 'type', 'args', 'funcs', 'labels', 'value',
+                 'extra')
+
+    KEYS = frozenset(__slots__) - {'extra'}
+
+    def __init__(self, op, dest=None, type=None, args=None, funcs=None,
+                 labels=None, value=None, extra=None):
+        self.op = op
+        self.dest = dest
+        self.type = type
+        self.args = args
+        self.funcs = funcs
+        self.labels = labels
+        self.value = value
+        self.extra = extra
+
+    @property
+    def opname(self):
+        return OPCODES[self.op]
+
+    @classmethod
+    def from_json(cls, data):
+        instr = cls(
+            opcode(data['op']),
+            data.get('dest'),
+            _intern_type(data.get('type')),
+            _names(data.get('args')),
+            _names(data.get('funcs')),
+            _names(data.get('labels')),
+            data.get('value'),
+            _extra(data, cls.KEYS),
+        )
+        if instr.dest is not None:
+            instr.dest = sys.intern(instr.dest)
+        return instr
+
+    def to_json(self):
+        out = {'op': OPCODES[self.op]}
+        if self.dest is not None:
+            out['dest'] = self.dest
+        if self.type is not None:
+            out['type'] = self.type
+        if self.args is not None:
+            out['args'] = list(self.args)
+        if self.funcs is not None:
+            out['funcs'] = list(self.funcs)
+        if self.labels is not None:
+            out['labels'] = list(self.labels)
+        if self.value is not None:
+            out['value'] = self.value
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    def __repr__(self):
+        return 'Instr({!r})'.format(self.to_json())
+
+
+class Label:
+    """A label in a function's instruction list.
+    """
+    __slots__ = ('name', 'extra')
+
+    def __init__(self, name, extra=None):
+        self.name = name
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(sys.intern(data['label']), _extra(data, {'label'}))
+
+    def to_json(self):
+        out = {'label': self.name}
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    def __repr__(self):
+        return 'Label({!r})'.format(self.name)
+
+
+def code_from_json(data):
+    """Convert an instruction or a label.
+    """
+    if 'label' in data:
+        return Label.from_json(data)
+    else:
+        return Instr.from_json(data)
+
+
+class Function:
+    """A Bril function. `args` is a list of (name, type) pairs, or None
+    if the function has no `args` key.
+    """
+    __slots__ = ('name', 'args', 'type', 'instrs', 'extra')
+
+    def __init__(self, name, args=None, type=None, instrs=None, extra=None):
+        self.name = name
+        self.args = args
+        self.type = type
+        self.instrs = instrs if instrs is not None else []
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, data):
+        args = data.get('args')
+        if args is not None:
+            args = [(sys.intern(a['name']), _intern_type(a['type']))
+                    for a in args]
+        return cls(
+            data['name'],
+            args,
+            _intern_type(data.get('type')),
+            [code_from_json(i) for i in data['instrs']],
+            _extra(data, {'name', 'args', 'type', 'instrs'}),
+        )
+
+    def to_json(self):
+        out = {
+            'name': self.name,
+            'instrs': [i.to_json() for i in self.instrs],
+        }
+        if self.args is not None:
+            out['args'] = [{'name': n, 'type': t} for n, t in self.args]
+        if self.type is not None:
+            out['type'] = self.type
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+
+class Program:
+    """A Bril program. Structs are kept in their JSON form.
+    """
+    __slots__ = ('functions', 'structs', 'extra')
+
+    def __init__(self, functions, structs=None, extra=None):
+        self.functions = functions
+        self.structs = structs
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            [Function.from_json(f) for f in data['functions']],
+            data.get('structs'),
+            _extra(data, {'functions', 'structs'}),
+        )
+
+    def to_json(self):
+        out = {'functions': [f.to_json() for f in self.functions]}
+        if self.structs is not None:
+            out['structs'] = self.structs
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+
+if __name__ == '__main__':
+    data = json.load(sys.stdin)
+    out = Program.from_json(data).to_json()
+    if out != data:
+        sys.exit('round trip through ir changed the program')
+    print(json.dumps(out, indent=2, sort_keys=True))
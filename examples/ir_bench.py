@@ -0,0 +1,108 @@
+"""Compare the dict and `ir` representations of Bril programs.
+
+Usage: `python ir_bench.py [COPIES]`. Parse every program in
+`benchmarks/`, replicate the corpus `COPIES` times (default 50), and
+report the memory used by each representation along with the throughput
+of converting between them and of a typical analysis loop (collecting
+the variables that are used and defined, as in `tdce.py`).
+"""
+
+import glob
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import briltxt
+
+from ir import Program, Instr
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'benchmarks', '*.bril')
+
+
+def load_corpus(copies):
+    texts = []
+    for path in sorted(glob.glob(BENCHMARKS)):
+        with open(path) as f:
+            texts.append(briltxt.parse_bril(f.read()))
+    return texts * copies
+
+
+def measure(build):
+    """Build a value and return it with the memory it retains.
+    """
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def dict_scan(progs):
+    used = set()
+    defined = set()
+    for prog in progs:
+        for func in prog['functions']:
+            for instr in func['instrs']:
+                used.update(instr.get('args', []))
+                if 'dest' in instr:
+                    defined.add(instr['dest'])
+    return used, defined
+
+
+def ir_scan(progs):
+    used = set()
+    defined = set()
+    for prog in progs:
+        for func in prog.functions:
+            for instr in func.instrs:
+                if isinstance(instr, Instr):
+                    if instr.args:
+                        used.update(instr.args)
+                    if instr.dest is not None:
+                        defined.add(instr.dest)
+    return used, defined
+
+
+def bench(copies):
+    texts = load_corpus(copies)
+    dicts, dict_size = measure(lambda: [json.loads(t) for t in texts])
+    ninstrs = sum(len(f['instrs']) for p in dicts for f in p['functions'])
+
+    progs, t_from = timed(lambda: [Program.from_json(d) for d in dicts])
+    out, t_to = timed(lambda: [p.to_json() for p in progs])
+    assert out == dicts, 'conversion is not lossless'
+    del progs, out
+
+    progs, ir_size = measure(
+        lambda: [Program.from_json(json.loads(t)) for t in texts]
+    )
+    d_res, t_dict = timed(dict_scan, dicts)
+    i_res, t_ir = timed(ir_scan, progs)
+    assert d_res == i_res
+
+    print('{} programs, {} instructions and labels'.format(
+        len(texts), ninstrs,
+    ))
+    print('memory (bytes per instruction):')
+    print('  dict: {:8.1f}'.format(dict_size / ninstrs))
+    print('  ir:   {:8.1f}'.format(ir_size / ninstrs))
+    print('throughput (instructions per second):')
+    for name, t in (('from_json', t_from), ('to_json', t_to),
+                    ('scan, dict', t_dict), ('scan, ir', t_ir)):
+        print('  {:11} {:12.0f}'.format(name, ninstrs / t))
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -1,5 +1,5 @@
-import json
 import sys
+from util import load
 
 
 def is_ssa(bril):
@@ -19,4 +19,4 @@ def is_ssa(bril):
 
 
 if __name__ == '__main__':
-    print('yes' if is_ssa(json.load(sys.stdin)) else 'no')
+    print('yes' if is_ssa(load(sys.stdin)) else 'no')
@@ -0,0 +1,181 @@
+"""Order the blocks of Bril functions so that jumps become fallthroughs.
+
+A `jmp` to the block that comes right after it does nothing, so
+`cfg.reassemble_compact` leaves it out. (Branches always name both of
+their targets, so they cost the same wherever their targets are.) Each
+block can follow at most one of the blocks that jump to it, so this
+pass picks, for every block, the most frequently executed of its
+jumping predecessors to come right before it, and then lays out the
+resulting chains of blocks starting with the entry.
+
+Block frequencies are estimated statically from the loop nesting depth:
+a block in `d` nested loops counts as running `10 ** d` times, and an
+unreachable block never runs. They can
+also come from a profile: a JSON file mapping function names to maps
+from block names to execution counts, like `{"main": {"loop": 100}}`.
+Blocks that are missing from the profile count as never run.
+
+With `--train ARGS...`, the pass makes its own profile by running the
+program once on the given arguments with `brili`. The program is
+instrumented to print a marker line whenever a block starts, which is
+recognized by a magic number. (A program that happens to print the same
+line only makes the profile less accurate.)
+"""
+import copy
+import json
+import subprocess
+import sys
+from collections import OrderedDict
+
+from analyses import AnalysisManager
+from cfg import (block_map, add_entry, add_terminators, reassemble,
+                 reassemble_compact)
+from form_blocks import form_blocks
+from licm import natural_loops
+from util import fresh, load
+
+# The first value on every line that the instrumented program prints
+# when a block starts.
+MARKER = -6917529027641081857
+
+
+def static_weights(succ, dom):
+    """Estimate how often each block runs from how deeply it is nested
+    in loops.
+    """
+    depth = {b: 0 for b in succ}
+    for body in natural_loops(succ, dom).values():
+        for b in body:
+            depth[b] += 1
+    # Unreachable blocks never run.
+    return {b: 10 ** d if b in dom[b] else 0 for b, d in depth.items()}
+
+
+def instrument(bril):
+    """Make a copy of a program that prints `MARKER` and a number at the
+    start of every block. Return the copy and the list of (function
+    name, block name) pairs that the numbers stand for.
+    """
+    bril = copy.deepcopy(bril)
+    sites = []
+    for func in bril['functions']:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_entry(blocks)
+        add_terminators(blocks)
+        variables = {i['dest'] for i in func['instrs'] if 'dest' in i}
+        variables |= {a['name'] for a in func.get('args', [])}
+        marker = fresh('prof.marker', variables)
+        number = fresh('prof.block', variables)
+        for name, block in blocks.items():
+            start = sum(1 for i in block if i.get('op') == 'phi')
+            block[start:start] = [
+                {'op': 'const', 'dest': marker, 'type': 'int',
+                 'value': MARKER},
+                {'op': 'const', 'dest': number, 'type': 'int',
+                 'value': len(sites)},
+                {'op': 'print', 'args': [marker, number]},
+            ]
+            sites.append((func['name'], name))
+        func['instrs'] = reassemble(blocks)
+    return bril, sites
+
+
+def train(bril, args):
+    """Profile a program by running it with `brili` on the given
+    arguments. Return the profile: a map from function names to maps
+    from block names to execution counts. Raise a
+    `subprocess.CalledProcessError` if the run fails, since its profile
+    would be incomplete.
+    """
+    prog, sites = instrument(bril)
+    out = subprocess.run(['brili'] + list(args), input=json.dumps(prog),
+                         stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True)
+    profile = {}
+    for func, block in sites:
+        profile.setdefault(func, {})[block] = 0
+    prefix = '{} '.format(MARKER)
+    for line in out.stdout.splitlines():
+        if line.startswith(prefix):
+            func, block = sites[int(line[len(prefix):])]
+            profile[func][block] += 1
+    return profile
+
+
+def chains(blocks, weights):
+    """Choose which block comes right after each block. Return a map
+    from blocks to the blocks that fall through to them.
+    """
+    entry = next(iter(blocks))
+    order = {name: i for i, name in enumerate(blocks)}
+    jumps = [(name, block[-1]['labels'][0])
+             for name, block in blocks.items() if block[-1]['op'] == 'jmp']
+    jumps.sort(key=lambda e: (-weights.get(e[0], 0), order[e[0]]))
+
+    # Every block jumps at most once, so `b` is always the last block of
+    # its chain and `s` has to be the first of its own. `first` maps the
+    # last block of each chain to its first, and `last` does the reverse.
+    prev = {}
+    first = {}
+    last = {}
+    for b, s in jumps:
+        if s == entry or s in prev:
+            continue
+        head = first.get(b, b)
+        if head == s:
+            continue  # This would close a cycle of fallthroughs.
+        prev[s] = b
+        tail = last.get(s, s)
+        first[tail] = head
+        last[head] = tail
+    return prev
+
+
+def order_blocks(blocks, weights):
+    """Reorder a block map to turn the most frequent jumps into
+    fallthroughs. Return a new block map.
+    """
+    prev = chains(blocks, weights)
+    follow = {b: s for s, b in prev.items()}
+    new_blocks = OrderedDict()
+    for name in blocks:
+        if name in prev:
+            continue  # Placed along with the start of its chain.
+        while name is not None:
+            new_blocks[name] = blocks[name]
+            name = follow.get(name)
+    return new_blocks
+
+
+def layout_func(func, am=None, profile=None):
+    """Lay out a function's blocks, using block counts from `profile`
+    (for the whole program) if it is given.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    labels = {i['label'] for i in func['instrs'] if 'label' in i}
+    if profile is None:
+        weights = static_weights(am['succ'], am['dom'])
+    else:
+        weights = profile.get(func['name'], {})
+    blocks = order_blocks(am['cfg'], weights)
+    func['instrs'] = reassemble_compact(blocks, labels)
+    am.invalidate()
+
+
+def layout(bril, profile=None):
+    for func in bril['functions']:
+        layout_func(func, profile=profile)
+    return bril
+
+
+if __name__ == '__main__':
+    bril = load(sys.stdin)
+    profile = None
+    if sys.argv[1:2] == ['--train']:
+        profile = train(bril, sys.argv[2:])
+    elif len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            profile = json.load(f)
+    bril = layout(bril, profile)
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
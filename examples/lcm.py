@@ -0,0 +1,270 @@
+"""Partial redundancy elimination by lazy code motion.
+
+This is the algorithm of Knoop, Rüthing, and Steffen as presented in
+the Dragon Book (section 9.5). An expression is an `lvn.Value` over
+variable names, like `add a b`. Four data flow analyses from `df.py`
+decide where each expression should be computed:
+
+- anticipated: the expression will be computed on every path from here
+  before its arguments change;
+- available: the expression has been computed on every path to here,
+  assuming it is inserted wherever it is first anticipated;
+- postponable: the computation can be delayed past this point without
+  making any path compute it more than before;
+- used: the result will be needed later.
+
+The expression is computed into a fresh variable at the latest point
+where it cannot be postponed any further, and the original computations
+become copies from that variable. Those copies are then propagated into
+their uses where possible, so `tdce.py` can delete them.
+
+To give the expressions places to go, every edge into a block with
+several predecessors first gets a block of its own. Afterward, the new
+blocks that received no code are removed, and the code in the others
+moves to the end of the predecessor unless the edge is critical.
+
+Functions in SSA form are rejected with a `ValueError`. The new blocks
+would change the labels that phi-nodes refer to, and an expression
+computed on several edges would assign its variable more than once.
+"""
+import copy
+import json
+import sys
+from collections import OrderedDict
+
+from analyses import AnalysisManager
+from cfg import reassemble
+from df import BitAnalysis, solve, union
+from lvn import Value, _canonicalize
+from util import fresh, fresh_names, load
+
+# Operations whose results only depend on their arguments. (Constants
+# and copies are left alone; moving them would not save anything.)
+PURE_OPS = {
+    'add', 'sub', 'mul', 'div', 'eq', 'lt', 'gt', 'le', 'ge', 'not', 'and',
+    'or', 'fadd', 'fsub', 'fmul', 'fdiv', 'feq', 'flt', 'fgt', 'fle',
+    'fge', 'ptradd',
+}
+
+
+def expression(instr):
+    """Get the expression an instruction computes, or None if it is not
+    a candidate for code motion.
+    """
+    if instr.get('op') in PURE_OPS and 'dest' in instr:
+        return _canonicalize(Value(instr['op'], tuple(instr['args'])))
+    return None
+
+
+def local_sets(block):
+    """Find the expressions a block uses (computes before any of their
+    arguments change) and kills (by changing one of their arguments).
+    The kill set is given as the set of variables the block assigns.
+    """
+    used = set()
+    defined = set()
+    for instr in block:
+        e = expression(instr)
+        if e is not None and not defined.intersection(e.args):
+            used.add(e)
+        if 'dest' in instr:
+            defined.add(instr['dest'])
+    return used, defined
+
+
+def split_edges(blocks, pred):
+    """Give every edge into a block with several predecessors a new,
+    empty block. Return a new block map with each new block right after
+    its predecessor, and the map from new block names to the edges they
+    split.
+    """
+    names = set(blocks)
+    splits = {}
+    after = {name: [] for name in blocks}
+    for s, ps in pred.items():
+        if len(ps) < 2:
+            continue
+        for p in sorted(set(ps), key=list(blocks).index):
+            label = fresh('{}.{}.'.format(p, s), names)
+            names.add(label)
+            term = blocks[p][-1]
+            term['labels'] = [label if lbl == s else lbl
+                              for lbl in term['labels']]
+            splits[label] = (p, s)
+            after[p].append((label, [{'op': 'jmp', 'labels': [s]}]))
+
+    new_blocks = OrderedDict()
+    for name, block in blocks.items():
+        new_blocks[name] = block
+        new_blocks.update(after[name])
+    return new_blocks, splits
+
+
+def unsplit_edges(blocks, splits, succ):
+    """Remove the blocks added by `split_edges` again, unless they are
+    needed to hold code for a critical edge. Return a new block map.
+    """
+    new_blocks = OrderedDict()
+    for name, block in blocks.items():
+        if name not in splits:
+            new_blocks[name] = block
+            continue
+        p, s = splits[name]
+        code = block[:-1]
+        if code and len(succ[p]) > 1:
+            new_blocks[name] = block  # A critical edge.
+            continue
+        blocks[p][-1:-1] = code
+        term = blocks[p][-1]
+        term['labels'] = [s if lbl == name else lbl for lbl in term['labels']]
+    return new_blocks
+
+
+def lazy_code_motion(blocks, succ, pred):
+    """Compute where to place each expression. Return a map from block
+    names to the expressions to compute at their entry, and a map from
+    block names to the expressions whose first computations in the block
+    should be replaced.
+    """
+    use, defs = {}, {}
+    for name, block in blocks.items():
+        use[name], defs[name] = local_sets(block)
+    universe = union(use.values())
+    kill = {name: {e for e in universe if defs[name].intersection(e.args)}
+            for name in blocks}
+
+    ant_in, _ = solve(blocks, BitAnalysis(False, use, kill, False))
+    av_in, _ = solve(blocks, BitAnalysis(
+        True, {b: ant_in[b] - kill[b] for b in blocks}, kill, False,
+    ))
+    earliest = {b: ant_in[b] - av_in[b] for b in blocks}
+    post_in, _ = solve(blocks, BitAnalysis(
+        True, {b: earliest[b] - use[b] for b in blocks}, use, False,
+    ))
+
+    latest = {}
+    for b in blocks:
+        here = earliest[b] | post_in[b]
+        later = set(universe)
+        for s in succ[b]:
+            later &= earliest[s] | post_in[s]
+        latest[b] = here & (use[b] | (universe - later))
+
+    _, used_out = solve(blocks, BitAnalysis(
+        False, {b: use[b] - latest[b] for b in blocks}, latest, True,
+    ))
+
+    insert = {b: latest[b] & used_out[b] for b in blocks}
+    replace = {b: use[b] - (latest[b] - used_out[b]) for b in blocks}
+    return insert, replace
+
+
+def propagate_copies(blocks, copies):
+    """Replace uses of the variables assigned by the given copy
+    instructions with the copied variables, wherever the copy reaches
+    along every path.
+    """
+    id_copies = {id(i) for i in copies}
+    mentions = {}
+    for instr in copies:
+        pair = (instr['dest'], instr['args'][0])
+        for var in pair:
+            mentions.setdefault(var, set()).add(pair)
+
+    gen, kill = {}, {}
+    for name, block in blocks.items():
+        avail = set()
+        killed = set()
+        for instr in block:
+            if 'dest' in instr:
+                dead = mentions.get(instr['dest'], set())
+                avail -= dead
+                killed |= dead
+            if id(instr) in id_copies:
+                avail.add((instr['dest'], instr['args'][0]))
+        gen[name], kill[name] = avail, killed
+    avail_in, _ = solve(blocks, BitAnalysis(True, gen, kill, False))
+
+    for name, block in blocks.items():
+        avail = dict(avail_in[name])
+        for instr in block:
+            if 'args' in instr and id(instr) not in id_copies:
+                instr['args'] = [avail.get(a, a) for a in instr['args']]
+            if 'dest' in instr:
+                avail = {x: t for x, t in avail.items()
+                         if instr['dest'] not in (x, t)}
+            if id(instr) in id_copies:
+                avail[instr['dest']] = instr['args'][0]
+
+
+def lcm_func(func, am=None):
+    """Eliminate partial redundancies in a function. Return the number
+    of expressions that were moved.
+    """
+    if any(i.get('op') == 'phi' for i in func['instrs']):
+        raise ValueError('lcm does not support SSA form (in @{})'.format(
+            func['name'],
+        ))
+    if am is None:
+        am = AnalysisManager(func)
+    original = copy.deepcopy(func['instrs'])
+    blocks, splits = split_edges(am['cfg'], am['pred'])
+    func['instrs'] = reassemble(blocks)
+    am.invalidate()
+    blocks = am['cfg']
+
+    insert, replace = lazy_code_motion(blocks, am['succ'], am['pred'])
+    if not any(insert.values()):
+        # Nothing moves, so leave the function as it was.
+        func['instrs'] = original
+        am.invalidate()
+        return 0
+
+    # A fresh variable for each expression that moves.
+    variables = {i['dest'] for b in blocks.values() for i in b if 'dest' in i}
+    variables |= {a['name'] for a in func.get('args', [])}
+    temps = fresh_names('lcm.', variables)
+    names = {}
+    types = {}
+    for block in blocks.values():
+        for instr in block:
+            e = expression(instr)
+            if e is not None:
+                types.setdefault(e, instr['type'])
+    for e in sorted(union(insert.values())):
+        names[e] = next(temps)
+
+    copies = []
+    for name, block in blocks.items():
+        # Replace the computations that are now redundant.
+        defined = set()
+        for instr in block:
+            e = expression(instr)
+            if e in replace[name] and e in names and \
+                    not defined.intersection(e.args):
+                instr.update({'op': 'id', 'args': [names[e]]})
+                copies.append(instr)
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+
+        # Compute the expressions that belong here.
+        block[0:0] = [{'op': e.op, 'dest': names[e], 'type': types[e],
+                       'args': list(e.args)}
+                      for e in sorted(insert[name])]
+
+    propagate_copies(blocks, copies)
+    blocks = unsplit_edges(blocks, splits, am['succ'])
+    func['instrs'] = reassemble(blocks)
+    am.invalidate()
+    return len(names)
+
+
+def lcm(bril):
+    for func in bril['functions']:
+        lcm_func(func)
+    return bril
+
+
+if __name__ == '__main__':
+    bril = lcm(load(sys.stdin))
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
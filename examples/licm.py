@@ -0,0 +1,224 @@
+"""Loop-invariant code motion for Bril programs in SSA form.
+
+Find the natural loops of each function from the back edges in its
+control-flow graph (edges whose target dominates their source), arrange
+them into a loop-nesting forest, and give each loop a preheader: a
+block that all entries to the loop pass through. Then, from the
+innermost loops out, move every instruction whose value cannot change
+while the loop runs into the loop's preheader.
+
+Only pure value operations move. Because the function is in SSA form,
+an instruction is invariant when none of its arguments are assigned
+inside the loop (after the invariant instructions have left it). The
+operations that can fail at run time, `div` and `load`, only move when
+they are sure to run anyway: when their block dominates every exit from
+the loop. A `load` also stays put if anything in the loop might write
+to memory.
+"""
+import json
+import sys
+from collections import OrderedDict
+
+from analyses import AnalysisManager, BLOCKS, CONTROL_FLOW
+from cfg import reassemble
+from dom import postorder
+from util import fresh, load
+
+# Operations that can be computed early without any effect.
+SAFE_OPS = {
+    'const', 'id', 'add', 'sub', 'mul', 'eq', 'lt', 'gt', 'le', 'ge',
+    'not', 'and', 'or', 'fadd', 'fsub', 'fmul', 'fdiv', 'feq', 'flt',
+    'fgt', 'fle', 'fge', 'ptradd',
+}
+
+# Operations that are pure but may fail at run time.
+GUARDED_OPS = {'div', 'load'}
+
+# Operations that may write to memory.
+WRITE_OPS = {'store', 'free', 'call'}
+
+
+def natural_loops(succ, dom):
+    """Find the natural loops in a CFG. Return a map from each loop
+    header to the set of blocks in the loop (including the header),
+    combining all the back edges to the same header.
+    """
+    pred = {b: [] for b in succ}
+    for b, ss in succ.items():
+        for s in ss:
+            pred[s].append(b)
+
+    # Unreachable blocks do not dominate themselves, and they are left
+    # out of every loop.
+    loops = {}
+    for b, ss in succ.items():
+        for h in ss:
+            if b not in dom[b] or h not in dom[b]:
+                continue
+            # A back edge from b to h. The loop contains everything that
+            # can reach b without going through h.
+            body = loops.setdefault(h, {h})
+            stack = [b]
+            while stack:
+                n = stack.pop()
+                if n not in body and n in dom[n]:
+                    body.add(n)
+                    stack.extend(pred[n])
+    return loops
+
+
+def loop_forest(loops):
+    """Arrange natural loops into a loop-nesting forest. Return a map
+    from each loop header to the header of the smallest loop that
+    contains it (or None for outermost loops).
+    """
+    parent = {}
+    for h in loops:
+        outer = [g for g in loops if g != h and h in loops[g]]
+        parent[h] = min(outer, key=lambda g: len(loops[g]), default=None)
+    return parent
+
+
+def _depth(parent, h):
+    depth = 0
+    while parent[h] is not None:
+        h = parent[h]
+        depth += 1
+    return depth
+
+
+def add_preheaders(blocks, succ, pred, loops):
+    """Make sure every loop header has a unique predecessor outside its
+    loop that jumps straight to it. Modify the blocks in place, and
+    return a new block map in which each new preheader comes right
+    before its header.
+
+    Phi-node arguments that came from outside the loop now come from the
+    preheader, through a new phi-node if they differ.
+    """
+    names = set(blocks)
+    variables = {i['dest'] for b in blocks.values() for i in b if 'dest' in i}
+    preheaders = {}
+    for h, body in loops.items():
+        outside = [p for p in pred[h] if p not in body]
+        if len(outside) == 1 and len(succ[outside[0]]) == 1:
+            continue  # Already a preheader.
+
+        pre = fresh('{}.preheader'.format(h), names)
+        names.add(pre)
+        preheaders[h] = pre
+        new_block = [{'op': 'jmp', 'labels': [h]}]
+        for p in outside:
+            term = blocks[p][-1]
+            term['labels'] = [pre if lbl == h else lbl
+                              for lbl in term['labels']]
+
+        for phi in (i for i in blocks[h] if i.get('op') == 'phi'):
+            pairs = list(zip(phi['args'], phi['labels']))
+            inside = [(a, lbl) for a, lbl in pairs if lbl in body]
+            from_outside = [(a, lbl) for a, lbl in pairs if lbl not in body]
+            if len({a for a, _ in from_outside}) == 1:
+                arg = from_outside[0][0]
+            else:
+                arg = fresh('{}.pre'.format(phi['dest']), variables)
+                variables.add(arg)
+                new_block.insert(-1, {
+                    'op': 'phi',
+                    'dest': arg,
+                    'type': phi['type'],
+                    'args': [a for a, _ in from_outside],
+                    'labels': [lbl for _, lbl in from_outside],
+                })
+            phi['args'] = [a for a, _ in inside] + [arg]
+            phi['labels'] = [lbl for _, lbl in inside] + [pre]
+        blocks.setdefault(pre, new_block)
+
+    new_blocks = OrderedDict()
+    for name, block in blocks.items():
+        if name in preheaders.values():
+            continue
+        if name in preheaders:
+            new_blocks[preheaders[name]] = blocks[preheaders[name]]
+        new_blocks[name] = block
+    return new_blocks
+
+
+def hoist(blocks, body, preheader, succ, dom, order):
+    """Move the loop-invariant instructions in a loop's blocks to the
+    end of its preheader. Return the number of instructions moved.
+    """
+    defined = {i['dest'] for b in body for i in blocks[b] if 'dest' in i}
+    writes = any(i.get('op') in WRITE_OPS for b in body for i in blocks[b])
+    exiting = [b for b in body if any(s not in body for s in succ[b])]
+
+    def invariant(instr, block):
+        op = instr.get('op')
+        if op in GUARDED_OPS:
+            if not exiting or any(block not in dom[e] for e in exiting):
+                return False
+            if op == 'load' and writes:
+                return False
+        elif op not in SAFE_OPS:
+            return False
+        return not any(a in defined for a in instr.get('args', []))
+
+    moved = []
+    changed = True
+    while changed:
+        changed = False
+        for b in sorted(body, key=order.get):
+            keep = []
+            for instr in blocks[b]:
+                if 'dest' in instr and invariant(instr, b):
+                    moved.append(instr)
+                    defined.discard(instr['dest'])
+                    changed = True
+                else:
+                    keep.append(instr)
+            blocks[b][:] = keep
+    blocks[preheader][-1:-1] = moved
+    return len(moved)
+
+
+def licm_func(func, am=None):
+    """Move loop-invariant code out of the loops in a function in SSA
+    form. Return the number of instructions moved.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    loops = natural_loops(am['succ'], am['dom'])
+    if not loops:
+        return 0
+
+    blocks = add_preheaders(am['cfg'], am['succ'], am['pred'], loops)
+    func['instrs'] = reassemble(blocks)
+    am.invalidate()
+
+    # Find the loops again, now with their preheaders.
+    blocks = am['cfg']
+    succ = am['succ']
+    dom = am['dom']
+    loops = natural_loops(succ, dom)
+    parent = loop_forest(loops)
+    entry = next(iter(blocks))
+    order = {b: -i for i, b in enumerate(postorder(succ, entry))}
+
+    moved = 0
+    for h in sorted(loops, key=lambda h: -_depth(parent, h)):
+        preheader, = (p for p in am['pred'][h] if p not in loops[h])
+        moved += hoist(blocks, loops[h], preheader, succ, dom, order)
+
+    func['instrs'] = reassemble(blocks)
+    am.invalidate(CONTROL_FLOW | BLOCKS)
+    return moved
+
+
+def licm(bril):
+    for func in bril['functions']:
+        licm_func(func)
+    return bril
+
+
+if __name__ == '__main__':
+    bril = licm(load(sys.stdin))
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
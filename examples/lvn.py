@@ -5,7 +5,7 @@ import sys
 from collections import namedtuple
 
 from form_blocks import form_blocks
-from util import flatten
+from util import flatten, load
 
 # A Value uniquely represents a computation in terms of sub-values.
 Value = namedtuple('Value', ['op', 'args'])
@@ -188,11 +188,18 @@ def _lookup(value2num, value):
         return value2num.get(value)
 
 
+def _div(a, b):
+    """Divide like Bril does, rounding toward zero (unlike `//`).
+    """
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
 FOLDABLE_OPS = {
     'add': lambda a, b: a + b,
     'mul': lambda a, b: a * b,
     'sub': lambda a, b: a - b,
-    'div': lambda a, b: a // b,
+    'div': _div,
     'gt': lambda a, b: a > b,
     'lt': lambda a, b: a < b,
     'ge': lambda a, b: a >= b,
@@ -246,23 +253,30 @@ def _canonicalize(value):
         return value
 
 
+def lvn_func(func, prop=False, canon=False, fold=False):
+    """Apply the local value numbering optimization to every basic block
+    in a function.
+    """
+    blocks = list(form_blocks(func['instrs']))
+    for block in blocks:
+        lvn_block(
+            block,
+            lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
+            canonicalize=_canonicalize if canon else lambda v: v,
+            fold=_fold if fold else lambda n2c, v: None,
+        )
+    func['instrs'] = flatten(blocks)
+
+
 def lvn(bril, prop=False, canon=False, fold=False):
     """Apply the local value numbering optimization to every basic block
     in every function.
     """
     for func in bril['functions']:
-        blocks = list(form_blocks(func['instrs']))
-        for block in blocks:
-            lvn_block(
-                block,
-                lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
-                canonicalize=_canonicalize if canon else lambda v: v,
-                fold=_fold if fold else lambda n2c, v: None,
-            )
-        func['instrs'] = flatten(blocks)
+        lvn_func(func, prop, canon, fold)
 
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
+    bril = load(sys.stdin)
     lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
     json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,172 @@
+"""Sparse conditional constant propagation for Bril programs in SSA form.
+
+This is Wegman and Zadeck's algorithm. Every variable starts out with
+no known value (it is absent from the value map), and can only move
+down to a single constant or to `'?'` (not a constant), like in the
+`cprop` analysis in `df.py`. Blocks are only evaluated once some edge
+into them is known to be executable, and a branch on a constant only
+makes one of its edges executable, so values that are only computed on
+paths that are never taken do not spoil the results.
+
+Afterward, every variable with a constant value is computed with a
+`const`, branches on constants become jumps, and blocks that are never
+reached are deleted. Run `tdce.py` afterward to clean up the constants
+that are no longer used.
+"""
+import json
+import sys
+from collections import OrderedDict, defaultdict
+
+from analyses import AnalysisManager
+from cfg import reassemble
+from lvn import Value, FOLDABLE_OPS, _fold
+from util import load
+
+UNDEFINED = '__undefined'
+
+
+def _meet(vals):
+    """Combine the values a variable may have on different paths.
+    """
+    out = None
+    for val in vals:
+        if val is None:
+            continue
+        if val == '?' or (out is not None and out != val):
+            return '?'
+        out = val
+    return out
+
+
+def sccp_func(func, am=None):
+    """Propagate constants through a function in SSA form, then fold
+    them into its instructions and delete unreachable blocks.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    blocks = am['cfg']
+    entry = next(iter(blocks))
+
+    uses = defaultdict(list)
+    defined = set()
+    for name, block in blocks.items():
+        for instr in block:
+            for arg in instr.get('args', []):
+                uses[arg].append((name, instr))
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+
+    # Function arguments, and variables that are never assigned at all,
+    # are not constants.
+    values = {var: '?' for var in uses if var not in defined}
+    values.update({arg['name']: '?' for arg in func.get('args', [])})
+    values.pop(UNDEFINED, None)
+    edges = set()
+    visited = set()
+    flow_work = [(None, entry)]
+    ssa_work = []
+
+    def lower(var, val):
+        old = values.get(var)
+        new = _meet([old, val])
+        if new != old:
+            values[var] = new
+            ssa_work.append(var)
+
+    def follow(block, label):
+        if (block, label) not in edges:
+            edges.add((block, label))
+            flow_work.append((block, label))
+
+    def evaluate(block, instr):
+        op = instr.get('op')
+        args = instr.get('args', [])
+        if op == 'phi':
+            lower(instr['dest'], _meet(
+                values.get(a) for a, label in zip(args, instr['labels'])
+                if a != UNDEFINED and (label, block) in edges
+            ))
+        elif op == 'br':
+            cond = values.get(args[0])
+            if cond == '?':
+                for label in instr['labels']:
+                    follow(block, label)
+            elif cond is not None:
+                follow(block, instr['labels'][0 if cond else 1])
+        elif op == 'jmp':
+            follow(block, instr['labels'][0])
+        elif 'dest' in instr:
+            if op == 'const':
+                val = instr['value']
+            elif op == 'id':
+                val = values.get(args[0])
+            elif op in FOLDABLE_OPS:
+                consts = {a: values[a] for a in args
+                          if values.get(a) not in (None, '?')}
+                val = _fold(consts, Value(op, tuple(args)))
+                if val is None and all(a in values for a in args):
+                    val = '?'
+            else:
+                val = '?'
+            lower(instr['dest'], val)
+
+    while flow_work or ssa_work:
+        while flow_work:
+            pred, name = flow_work.pop()
+            if name in visited:
+                # Only the phi-nodes depend on which edges are executable.
+                for instr in blocks[name]:
+                    if instr.get('op') == 'phi':
+                        evaluate(name, instr)
+            else:
+                visited.add(name)
+                for instr in blocks[name]:
+                    evaluate(name, instr)
+        while ssa_work:
+            for name, instr in uses[ssa_work.pop()]:
+                if name in visited:
+                    evaluate(name, instr)
+
+    # Rewrite the reachable blocks and drop the rest.
+    new_blocks = OrderedDict()
+    for name, block in blocks.items():
+        if name not in visited:
+            continue
+        for instr in block:
+            op = instr.get('op')
+            val = values.get(instr.get('dest'))
+            if val not in (None, '?'):
+                if op != 'const':
+                    for key in ('args', 'labels', 'funcs'):
+                        instr.pop(key, None)
+                    instr.update({'op': 'const', 'value': val})
+            elif op == 'phi':
+                pairs = [(a, label) for a, label
+                         in zip(instr['args'], instr['labels'])
+                         if (label, name) in edges]
+                instr['args'] = [a for a, _ in pairs]
+                instr['labels'] = [label for _, label in pairs]
+            elif op == 'br':
+                cond = values.get(instr['args'][0])
+                if cond not in (None, '?'):
+                    label = instr['labels'][0 if cond else 1]
+                    del instr['args']
+                    instr.update({'op': 'jmp', 'labels': [label]})
+        # Constants may have replaced phi-nodes, so put the remaining
+        # phi-nodes back at the top.
+        block.sort(key=lambda instr: instr.get('op') != 'phi')
+        new_blocks[name] = block
+
+    func['instrs'] = reassemble(new_blocks)
+    am.invalidate()
+
+
+def sccp(bril):
+    for func in bril['functions']:
+        sccp_func(func)
+    return bril
+
+
+if __name__ == '__main__':
+    bril = sccp(load(sys.stdin))
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
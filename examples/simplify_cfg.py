@@ -0,0 +1,268 @@
+"""Simplify the control-flow graphs of Bril programs.
+
+Passes like `to_ssa.py` and `from_ssa.py` leave behind blocks that only
+jump to the next one, and every such jump costs an instruction at run
+time. This pass repeats a few small rewrites until none of them applies:
+
+- delete the blocks that are unreachable from the entry;
+- turn branches on a known constant (or to the same block twice) into
+  jumps;
+- thread jumps to a block that only branches on a constant known at the
+  end of the jumping block straight to the branch's target;
+- forward blocks that only jump, so their predecessors jump straight to
+  the target;
+- merge a block that jumps to a block with no other predecessors with
+  that block.
+
+A branch condition is a known constant when it was last assigned by a
+`const` in the same block, or when the variable is assigned only once in
+the whole function, by a `const`. The pass works on programs with or
+without phi-nodes, and updates the phi-nodes' labels as blocks go away.
+"""
+import json
+import sys
+
+from analyses import AnalysisManager
+from cfg import reassemble_compact, successors
+from dom import map_inv, postorder
+from util import load
+
+# The argument to-SSA conversion gives phi-nodes for the edges where a
+# variable has no value.
+UNDEFINED = '__undefined'
+
+
+def _phis(block):
+    return [i for i in block if i.get('op') == 'phi']
+
+
+def _edges(blocks):
+    succ = {name: successors(block[-1]) for name, block in blocks.items()}
+    return succ, map_inv(succ)
+
+
+def _retarget(term, old, new):
+    term['labels'] = [new if lbl == old else lbl for lbl in term['labels']]
+
+
+def _drop_phi_args(block, label):
+    """Remove the arguments coming from `label` from a block's
+    phi-nodes.
+    """
+    for phi in _phis(block):
+        pairs = [(a, lbl) for a, lbl in zip(phi['args'], phi['labels'])
+                 if lbl != label]
+        phi['args'] = [a for a, _ in pairs]
+        phi['labels'] = [lbl for _, lbl in pairs]
+
+
+def constants(func, blocks):
+    """Find the variables that are assigned only once, by a `const`.
+    Return a map from these variables to their values.
+    """
+    count = {arg['name']: 1 for arg in func.get('args', [])}
+    values = {}
+    for block in blocks.values():
+        for instr in block:
+            if 'dest' in instr:
+                count[instr['dest']] = count.get(instr['dest'], 0) + 1
+                if instr['op'] == 'const':
+                    values[instr['dest']] = instr['value']
+    return {var: val for var, val in values.items() if count[var] == 1}
+
+
+def _value_at_end(block, var, consts):
+    """Get the constant value of `var` at the end of a block, or None if
+    it is not known.
+    """
+    for instr in reversed(block[:-1]):
+        if instr.get('dest') == var:
+            return instr['value'] if instr['op'] == 'const' else None
+    return consts.get(var)
+
+
+def remove_unreachable(blocks):
+    """Delete the blocks that cannot be reached from the entry. Return
+    the number of blocks deleted.
+    """
+    succ, _ = _edges(blocks)
+    reachable = set(postorder(succ, next(iter(blocks))))
+    dead = [name for name in blocks if name not in reachable]
+    for name in dead:
+        for s in succ[name]:
+            if s in reachable:
+                _drop_phi_args(blocks[s], name)
+        del blocks[name]
+    return len(dead)
+
+
+def fold_branches(blocks, consts):
+    """Turn branches whose direction is known into jumps. Return the
+    number of branches folded.
+    """
+    folded = 0
+    for name, block in blocks.items():
+        term = block[-1]
+        if term['op'] != 'br':
+            continue
+        true, false = term['labels']
+        if true == false:
+            target = true
+        else:
+            cond = _value_at_end(block, term['args'][0], consts)
+            if cond is None:
+                continue
+            target, other = (true, false) if cond else (false, true)
+            _drop_phi_args(blocks[other], name)
+        block[-1] = {'op': 'jmp', 'labels': [target]}
+        folded += 1
+    return folded
+
+
+def thread_jumps(blocks, consts):
+    """Send jumps to blocks that only branch on a condition known at the
+    end of the jumping block straight to the branch's destination.
+    Return the number of jumps threaded.
+    """
+    threaded = 0
+    _, pred = _edges(blocks)
+    for name, block in blocks.items():
+        term = block[-1]
+        if term['op'] != 'jmp':
+            continue
+        mid = term['labels'][0]
+        mid_block = blocks[mid]
+        if len(mid_block) != 1 or mid_block[0]['op'] != 'br':
+            continue
+        cond = _value_at_end(block, mid_block[0]['args'][0], consts)
+        if cond is None:
+            continue
+        target = mid_block[0]['labels'][0 if cond else 1]
+        if target == mid:
+            continue  # The branch loops back to itself.
+        if name in pred[target] and _phis(blocks[target]):
+            continue  # The phi-nodes cannot tell the two edges apart.
+
+        # The new edge carries the same phi-node arguments as the edge
+        # from the branching block, which defines nothing itself.
+        for phi in _phis(blocks[target]):
+            if mid in phi['labels']:
+                phi['args'].append(phi['args'][phi['labels'].index(mid)])
+                phi['labels'].append(name)
+        term['labels'] = [target]
+        pred[mid].remove(name)
+        pred[target].append(name)
+        threaded += 1
+    return threaded
+
+
+def forward_empty(blocks):
+    """Remove the blocks (other than the entry) that only jump to
+    another block, sending their predecessors straight to the target.
+    Return the number of blocks removed.
+    """
+    removed = 0
+    entry = next(iter(blocks))
+    succ, pred = _edges(blocks)
+    for name in list(blocks):
+        block = blocks[name]
+        if name == entry or len(block) != 1 or block[0]['op'] != 'jmp':
+            continue
+        target = block[0]['labels'][0]
+        if target == name:
+            continue  # An infinite loop.
+        preds = set(pred[name])
+        if _phis(blocks[target]) and (preds & set(pred[target]) - {name}):
+            continue  # The phi-nodes cannot tell the edges apart.
+
+        for phi in _phis(blocks[target]):
+            if name in phi['labels']:
+                arg = phi['args'][phi['labels'].index(name)]
+                _drop_phi_args([phi], name)
+                phi['args'] += [arg] * len(preds)
+                phi['labels'] += sorted(preds)
+        for p in preds:
+            _retarget(blocks[p][-1], name, target)
+            succ[p] = successors(blocks[p][-1])
+        pred[target] = [p for p in pred[target] if p != name] + pred[name]
+        del blocks[name], succ[name], pred[name]
+        removed += 1
+    return removed
+
+
+def merge_blocks(blocks):
+    """Merge every block that ends in a jump with its successor, when it
+    is the successor's only predecessor. Return the number of blocks
+    merged away.
+    """
+    merged = 0
+    entry = next(iter(blocks))
+    succ, pred = _edges(blocks)
+    for name in list(blocks):
+        if name not in blocks:
+            continue
+        while True:
+            block = blocks[name]
+            if block[-1]['op'] != 'jmp':
+                break
+            s = block[-1]['labels'][0]
+            phis = _phis(blocks[s])
+            if s in (name, entry) or pred[s] != [name] or \
+                    any(len(phi['args']) != 1 for phi in phis):
+                break
+
+            # With a single predecessor, phi-nodes are just copies. One
+            # whose only argument is undefined leaves its variable
+            # undefined, so it can go.
+            undefined = {id(phi) for phi in phis
+                         if phi['args'] == [UNDEFINED]}
+            for phi in phis:
+                phi['op'] = 'id'
+                del phi['labels']
+            block[-1:] = [i for i in blocks.pop(s) if id(i) not in undefined]
+            for t in set(succ[s]):
+                for phi in _phis(blocks[t]):
+                    phi['labels'] = [name if lbl == s else lbl
+                                     for lbl in phi['labels']]
+                pred[t] = [name if p == s else p for p in pred[t]]
+            succ[name] = succ.pop(s)
+            del pred[s]
+            merged += 1
+    return merged
+
+
+def simplify_cfg_func(func, am=None):
+    """Simplify the control-flow graph of a function until nothing
+    changes. Return the number of rewrites.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    labels = {i['label'] for i in func['instrs'] if 'label' in i}
+    blocks = am['cfg']
+    consts = constants(func, blocks)
+
+    total = 0
+    while True:
+        changed = (remove_unreachable(blocks) +
+                   fold_branches(blocks, consts) +
+                   thread_jumps(blocks, consts) +
+                   forward_empty(blocks) +
+                   merge_blocks(blocks))
+        if not changed:
+            break
+        total += changed
+
+    func['instrs'] = reassemble_compact(blocks, labels)
+    am.invalidate()
+    return total
+
+
+def simplify_cfg(bril):
+    for func in bril['functions']:
+        simplify_cfg_func(func)
+    return bril
+
+
+if __name__ == '__main__':
+    bril = simplify_cfg(load(sys.stdin))
+    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
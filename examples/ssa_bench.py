@@ -0,0 +1,89 @@
+"""Measure how conversion to SSA scales with the size of a function.
+
+Usage: `python ssa_bench.py [SIZE...]`. For each size (by default 10^3
+through 10^5), generate a function with a chain of that many diamonds
+inside a loop, so the dominator tree is very deep and the number of
+variables grows with the function. Time each stage of `func_to_ssa`
+and print the time per block, which should stay roughly constant as the
+size grows.
+"""
+
+import sys
+import time
+
+from analyses import AnalysisManager
+from to_ssa import def_blocks, get_phis, ssa_rename, insert_phis
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+
+
+def gen_func(ndiamonds):
+    """Generate a function with `ndiamonds` if-then-else diamonds in a
+    loop. Each diamond defines a new variable on both sides and updates
+    an accumulator that is live around the loop.
+    """
+    instrs = [
+        {'op': 'const', 'dest': 'acc', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'n', 'type': 'int', 'value': 10},
+        {'label': 'header'},
+        {'op': 'lt', 'dest': 'c', 'type': 'bool', 'args': ['acc', 'n']},
+        {'op': 'br', 'args': ['c'], 'labels': ['d0', 'exit']},
+    ]
+    for i in range(ndiamonds):
+        x = 'x{}'.format(i)
+        instrs += [
+            {'label': 'd{}'.format(i)},
+            {'op': 'br', 'args': ['c'],
+             'labels': ['t{}'.format(i), 'f{}'.format(i)]},
+            {'label': 't{}'.format(i)},
+            {'op': 'const', 'dest': x, 'type': 'int', 'value': 1},
+            {'op': 'jmp', 'labels': ['j{}'.format(i)]},
+            {'label': 'f{}'.format(i)},
+            {'op': 'const', 'dest': x, 'type': 'int', 'value': 2},
+            {'label': 'j{}'.format(i)},
+            {'op': 'add', 'dest': 'acc', 'type': 'int', 'args': ['acc', x]},
+        ]
+    instrs += [
+        {'label': 'd{}'.format(ndiamonds)},
+        {'op': 'jmp', 'labels': ['header']},
+        {'label': 'exit'},
+        {'op': 'print', 'args': ['acc']},
+    ]
+    return {'name': 'main', 'instrs': instrs}
+
+
+def bench(ndiamonds):
+    func = gen_func(ndiamonds)
+    types = {i['dest']: i['type'] for i in func['instrs'] if 'dest' in i}
+    times = []
+
+    def stage(func, *args):
+        start = time.perf_counter()
+        res = func(*args)
+        times.append(time.perf_counter() - start)
+        return res
+
+    am = AnalysisManager(func)
+    blocks = stage(lambda: am['cfg'])
+    stage(lambda: (am['dom_fronts'], am['dom_tree']))
+    phis = stage(get_phis, blocks, am['dom_fronts'], def_blocks(blocks))
+    phi_args, phi_dests = stage(ssa_rename, blocks, phis, am['succ'],
+                                am['dom_tree'], set())
+    stage(insert_phis, blocks, phi_args, phi_dests, types)
+    return len(blocks), times
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    print('{:>9} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'blocks', 'cfg', 'dom', 'phis', 'rename', 'insert', 'total (s)',
+        'us/block',
+    ))
+    for size in sizes:
+        nblocks, times = bench(size)
+        print('{:>9} {} {:10.4f} {:9.2f}'.format(
+            nblocks,
+            ' '.join('{:10.4f}'.format(t) for t in times),
+            sum(times),
+            sum(times) / nblocks * 1e6,
+        ))
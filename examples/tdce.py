@@ -1,11 +1,17 @@
 """Trivial dead code elimination for Bril programs---a demonstration of
 local optimization.
+
+The `adce` mode is the global alternative: aggressive dead code
+elimination, which assumes everything is dead until proven otherwise.
 """
 
 import sys
 import json
+from cfg import (block_map, add_entry, add_terminators, reassemble_compact,
+                 successors)
+from dom import get_idom, idom_fronts, map_inv, postorder
 from form_blocks import form_blocks
-from util import flatten
+from util import flatten, fresh, load
 
 
 def trivial_dce_pass(func):
@@ -112,11 +118,209 @@ def trivial_dce_plus(func):
         pass
 
 
+def _is_root(instr):
+    """Check whether an instruction is live no matter what: it returns,
+    has some other effect, or is a call (which might have one).
+    """
+    op = instr['op']
+    if op in ('br', 'jmp', 'nop'):
+        return False
+    return 'dest' not in instr or op == 'call'
+
+
+def _postdominators(succ, pred, reachable):
+    """Compute immediate postdominators and control dependence for the
+    reachable blocks. Return the map of immediate postdominators, the
+    map from each block to the blocks whose branches control whether it
+    runs (its postdominance frontier), the name of the virtual exit
+    node, and the blocks in loops that never exit.
+    """
+    exit = fresh('exit', succ)
+    rsucc = {b: [p for p in pred[b] if p in reachable] for b in reachable}
+    rsucc[exit] = [b for b in reachable if not succ[b]]
+
+    # Blocks that cannot reach a return get an edge to the exit, so they
+    # have postdominators too. Their branches are always kept.
+    reaches = set(postorder(rsucc, exit))
+    endless = [b for b in reachable if b not in reaches]
+    rsucc[exit] += endless
+
+    ipdom = get_idom(rsucc, exit)
+    return ipdom, idom_fronts(ipdom, rsucc), exit, endless
+
+
+def _forward_empty(blocks, entry):
+    """Remove blocks that contain nothing but a jump, sending their
+    predecessors straight to the jump's target. Blocks jumping to
+    phi-nodes stay, since the phi-nodes mention them.
+    """
+    def forwardable(name):
+        block = blocks[name]
+        return (name != entry and len(block) == 1 and
+                block[0]['op'] == 'jmp' and
+                blocks[block[0]['labels'][0]][0].get('op') != 'phi')
+
+    dest = {}
+    for name in blocks:
+        # Follow the chain of empty blocks, stopping at a cycle.
+        seen = set()
+        label = name
+        while forwardable(label) and label not in seen:
+            seen.add(label)
+            label = blocks[label][0]['labels'][0]
+        dest[name] = label
+    for name, block in blocks.items():
+        term = block[-1]
+        if term['op'] in ('jmp', 'br'):
+            term['labels'] = [dest[lbl] for lbl in term['labels']]
+    for name in list(blocks):
+        if dest[name] != name:
+            del blocks[name]
+
+
+def aggressive_dce(func):
+    """Delete every instruction that cannot affect the function's
+    effects or return value, along with branches that do not affect
+    which of those run.
+
+    Marking starts from the instructions with effects and follows the
+    variables they use back to their definitions, and each block with
+    live code back to the branches it is control dependent on. Each
+    instruction is marked at most once. Then one sweep deletes the
+    unmarked instructions, turns unmarked branches into jumps to the
+    nearest postdominator with live code, and deletes the blocks that
+    are left unreachable or empty.
+    """
+    labels = {i['label'] for i in func['instrs'] if 'label' in i}
+    blocks = block_map(form_blocks(func['instrs']))
+    add_entry(blocks)
+    add_terminators(blocks)
+    succ = {name: successors(block[-1]) for name, block in blocks.items()}
+    entry = next(iter(blocks))
+    reachable = set(postorder(succ, entry))
+    ipdom, control, exit, endless = _postdominators(succ, map_inv(succ),
+                                                    reachable)
+
+    # Def-use chains. A use of a variable assigned earlier in the same
+    # block depends on that assignment; any other use depends on every
+    # assignment to the variable that reaches the end of its block.
+    local_deps = {}
+    exposed_uses = {}
+    exposed_defs = {}
+    for name in reachable:
+        last_def = {}
+        for instr in blocks[name]:
+            local, exposed = [], []
+            for arg in instr.get('args', []):
+                if arg in last_def and instr['op'] != 'phi':
+                    local.append(last_def[arg])
+                else:
+                    exposed.append(arg)
+            local_deps[id(instr)] = local
+            exposed_uses[id(instr)] = exposed
+            if 'dest' in instr:
+                last_def[instr['dest']] = (name, instr)
+        for var, site in last_def.items():
+            exposed_defs.setdefault(var, []).append(site)
+
+    live = set()
+    useful = set()
+    followed = set()
+    worklist = []
+
+    def mark(name, instr):
+        if id(instr) not in live:
+            live.add(id(instr))
+            worklist.append((name, instr))
+
+    def propagate():
+        while worklist:
+            name, instr = worklist.pop()
+            for site in local_deps[id(instr)]:
+                mark(*site)
+            for var in exposed_uses[id(instr)]:
+                if var not in followed:
+                    followed.add(var)
+                    for site in exposed_defs.get(var, []):
+                        mark(*site)
+            if instr['op'] == 'phi':
+                # The predecessors must still jump here.
+                for label in instr['labels']:
+                    if label in reachable:
+                        mark(label, blocks[label][-1])
+            if name not in useful:
+                useful.add(name)
+                for c in control[name]:
+                    if c != exit:
+                        mark(c, blocks[c][-1])
+
+    def nearest_useful(name):
+        b = ipdom[name]
+        while b != exit and b not in useful:
+            b = ipdom[b]
+        return b
+
+    for name in reachable:
+        for instr in blocks[name]:
+            if _is_root(instr):
+                mark(name, instr)
+    for name in endless:
+        mark(name, blocks[name][-1])
+    propagate()
+
+    # A dead branch becomes a jump to its nearest useful postdominator.
+    # Keep the branch instead if there is none, or if it would need new
+    # phi-node arguments.
+    targets = {}
+    pending = [b for b in reachable if blocks[b][-1]['op'] == 'br']
+    while pending:
+        name = pending.pop()
+        term = blocks[name][-1]
+        if id(term) in live:
+            continue
+        target = nearest_useful(name)
+        if target == exit or blocks[target][0].get('op') == 'phi':
+            mark(name, term)
+            propagate()
+            pending += [b for b in targets if id(blocks[b][-1]) not in live]
+            targets.clear()
+        else:
+            targets[name] = target
+
+    # Sweep.
+    for name in reachable:
+        block = blocks[name]
+        block[:] = [i for i in block if id(i) in live or i['op'] == 'jmp']
+        if name in targets:
+            block.append({'op': 'jmp', 'labels': [targets[name]]})
+
+    # Drop the blocks that can no longer run, and the phi-node arguments
+    # that came from them.
+    succ = {name: blocks[name][-1].get('labels', []) for name in reachable}
+    reachable = set(postorder(succ, entry))
+    for name in list(blocks):
+        if name not in reachable:
+            del blocks[name]
+    pred = map_inv({name: succ[name] for name in blocks})
+    for name, block in blocks.items():
+        for instr in block:
+            if instr['op'] == 'phi':
+                pairs = [(a, lbl) for a, lbl
+                         in zip(instr['args'], instr['labels'])
+                         if lbl in pred[name]]
+                instr['args'] = [a for a, _ in pairs]
+                instr['labels'] = [lbl for _, lbl in pairs]
+    _forward_empty(blocks, entry)
+
+    func['instrs'] = reassemble_compact(blocks, labels)
+
+
 MODES = {
     'tdce': trivial_dce,
     'tdcep': trivial_dce_pass,
     'dkp': drop_killed_pass,
     'tdce+': trivial_dce_plus,
+    'adce': aggressive_dce,
 }
 
 
@@ -127,7 +331,7 @@ def localopt():
         modify_func = trivial_dce
 
     # Apply the change to all the functions in the input program.
-    bril = json.load(sys.stdin)
+    bril = load(sys.stdin)
     for func in bril['functions']:
         modify_func(func)
     json.dump(bril, sys.stdout, indent=2, sort_keys=True)
@@ -2,9 +2,18 @@ import json
 import sys
 from collections import defaultdict
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
-from dom import get_dom, dom_fronts, dom_tree
+from cfg import reassemble
+from analyses import AnalysisManager, BLOCKS, CONTROL_FLOW
+from df import union, use
+from util import load
+
+# How many phi-nodes to insert:
+# - minimal: At the iterated dominance frontier of every definition.
+# - semi-pruned: Like minimal, but only for variables that are read in
+#   some block before being written there, so they might be live across
+#   a block boundary.
+# - pruned: Only where the variable is live.
+MODES = ('minimal', 'semi-pruned', 'pruned')
 
 
 def def_blocks(blocks):
@@ -18,91 +27,135 @@ def def_blocks(blocks):
     return dict(out)
 
 
-def get_phis(blocks, df, defs):
+def global_names(blocks):
+    """Get the variables that are read in some block before being
+    written there. Only these can be live across a block boundary.
+    """
+    return union(use(block) for block in blocks.values())
+
+
+def get_phis(blocks, df, defs, live_in=None):
     """Find where to insert phi-nodes in the blocks.
 
     Produce a map from block names to variable names that need phi-nodes
     in those blocks. (We will need to generate names and actually insert
-    instructions later.)
+    instructions later.) If `live_in` maps blocks to the variables live
+    at their entry, only insert phi-nodes for live variables.
     """
     phis = {b: set() for b in blocks}
     for v, v_defs in defs.items():
-        v_defs_list = list(v_defs)
-        for d in v_defs_list:
+        # The blocks that define v, including with phi-nodes, and those
+        # of them whose frontiers we still need to visit.
+        has_def = set(v_defs)
+        worklist = list(v_defs)
+        while worklist:
+            d = worklist.pop()
             for block in df[d]:
+                if live_in is not None and v not in live_in[block]:
+                    continue  # Dead here.
+
                 # Add a phi-node...
                 if v not in phis[block]:
                     # ..unless we already did.
                     phis[block].add(v)
-                    if block not in v_defs_list:
-                        v_defs_list.append(block)
+                    if block not in has_def:
+                        has_def.add(block)
+                        worklist.append(block)
     return phis
 
 
 def ssa_rename(blocks, phis, succ, domtree, args):
+    """Rename every variable so it has one definition, walking the
+    dominator tree with an explicit stack.
+
+    Each variable has a stack of names, with the current name on top.
+    Every block records the variables it pushed names for, so that when
+    the walk leaves the block's subtree it pops exactly those names.
+    """
     stack = defaultdict(list, {v: [v] for v in args})
     phi_args = {b: {p: [] for p in phis[b]} for b in blocks}
     phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
     counters = defaultdict(int)
 
-    def _push_fresh(var):
+    def _push_fresh(var, pushed):
         fresh = '{}.{}'.format(var, counters[var])
         counters[var] += 1
-        stack[var].insert(0, fresh)
+        stack[var].append(fresh)
+        pushed.append(var)
         return fresh
 
     def _rename(block):
-        # Save stacks.
-        old_stack = {k: list(v) for k, v in stack.items()}
+        """Rename a block's instructions and the phi-node arguments in its
+        successors. Return the variables pushed.
+        """
+        pushed = []
 
         # Rename phi-node destinations.
         for p in phis[block]:
-            phi_dests[block][p] = _push_fresh(p)
+            phi_dests[block][p] = _push_fresh(p, pushed)
 
         for instr in blocks[block]:
             # Rename arguments in normal instructions.
+            # (A variable with no definition on the way here keeps its
+            # name; it can only be used in an unreachable block.)
             if 'args' in instr:
-                new_args = [stack[arg][0] for arg in instr['args']]
+                new_args = [stack[arg][-1] if stack[arg] else arg
+                            for arg in instr['args']]
                 instr['args'] = new_args
 
             # Rename destinations.
             if 'dest' in instr:
-                instr['dest'] = _push_fresh(instr['dest'])
+                instr['dest'] = _push_fresh(instr['dest'], pushed)
 
         # Rename phi-node arguments (in successors).
         for s in succ[block]:
             for p in phis[s]:
                 if stack[p]:
-                    phi_args[s][p].append((block, stack[p][0]))
+                    phi_args[s][p].append((block, stack[p][-1]))
                 else:
                     # The variable is not defined on this path
                     phi_args[s][p].append((block, "__undefined"))
 
-        # Recursive calls.
-        for b in sorted(domtree[block]):
-            _rename(b)
-
-        # Restore stacks.
-        stack.clear()
-        stack.update(old_stack)
-
-    entry = list(blocks.keys())[0]
-    _rename(entry)
+        return pushed
+
+    # Walk the tree in preorder. Each entry holds a block's remaining
+    # children and the variables it pushed. Unreachable blocks are not
+    # in the tree under the entry, so each one gets a walk of its own
+    # afterward.
+    visited = set()
+    for root in blocks:
+        if root in visited:
+            continue
+        visited.add(root)
+        walk = [(iter(sorted(domtree.get(root, ()))), _rename(root))]
+        while walk:
+            children, pushed = walk[-1]
+            child = next(children, None)
+            if child is not None:
+                visited.add(child)
+                walk.append((iter(sorted(domtree.get(child, ()))),
+                             _rename(child)))
+            else:
+                # Restore stacks.
+                walk.pop()
+                for var in pushed:
+                    stack[var].pop()
 
     return phi_args, phi_dests
 
 
 def insert_phis(blocks, phi_args, phi_dests, types):
     for block, instrs in blocks.items():
-        for dest, pairs in sorted(phi_args[block].items()):
-            phi = {
+        phis = []
+        for dest, pairs in sorted(phi_args[block].items(), reverse=True):
+            phis.append({
                 'op': 'phi',
                 'dest': phi_dests[block][dest],
                 'type': types[dest],
                 'labels': [p[0] for p in pairs],
                 'args': [p[1] for p in pairs],
-            }
-            instrs.insert(0, phi)
+            })
+        instrs[:0] = phis
 
 
 def get_types(func):
@@ -116,31 +169,53 @@ def get_types(func):
     return types
 
 
-def func_to_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
-    dom = get_dom(succ, list(blocks.keys())[0])
+def func_to_ssa(func, am=None, mode='minimal'):
+    """Convert a function to SSA form, using (and updating) the analyses
+    cached in `am`, if given. `mode` is one of `MODES`. Return the number
+    of phi-nodes inserted.
+    """
+    if am is None:
+        am = AnalysisManager(func)
+    blocks = am['cfg']
 
-    df = dom_fronts(dom, succ)
     defs = def_blocks(blocks)
     types = get_types(func)
     arg_names = {a['name'] for a in func['args']} if 'args' in func else set()
 
-    phis = get_phis(blocks, df, defs)
-    phi_args, phi_dests = ssa_rename(blocks, phis, succ, dom_tree(dom),
+    live_in = None
+    if mode == 'semi-pruned':
+        names = global_names(blocks)
+        defs = {v: ds for v, ds in defs.items() if v in names}
+    elif mode == 'pruned':
+        live_in = am['live'][0]
+    elif mode != 'minimal':
+        raise ValueError('unknown mode {}'.format(mode))
+
+    phis = get_phis(blocks, am['dom_fronts'], defs, live_in)
+    phi_args, phi_dests = ssa_rename(blocks, phis, am['succ'], am['dom_tree'],
                                      arg_names)
     insert_phis(blocks, phi_args, phi_dests, types)
 
+    # The function is now exactly its (modified) CFG, so only the
+    # variable-dependent analyses are out of date.
     func['instrs'] = reassemble(blocks)
+    am.invalidate(CONTROL_FLOW | BLOCKS)
+    return sum(len(ps) for ps in phis.values())
 
 
-def to_ssa(bril):
+def to_ssa(bril, mode='minimal', stats=False):
     for func in bril['functions']:
-        func_to_ssa(func)
+        nphis = func_to_ssa(func, mode=mode)
+        if stats:
+            print('@{}: {} phis'.format(func['name'], nphis), file=sys.stderr)
     return bril
 
 
 if __name__ == '__main__':
-    print(json.dumps(to_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    args = sys.argv[1:]
+    mode = 'minimal'
+    for m in MODES:
+        if '--' + m in args:
+            mode = m
+    bril = to_ssa(load(sys.stdin), mode, '--stats' in args)
+    print(json.dumps(bril, indent=2, sort_keys=True))
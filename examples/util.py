@@ -1,4 +1,5 @@
 import itertools
+import json
 
 
 def flatten(ll):
@@ -10,9 +11,34 @@ def flatten(ll):
 def fresh(seed, names):
     """Generate a new name that is not in `names` starting with `seed`.
     """
+    return next(fresh_names(seed, names))
+
+
+def fresh_names(seed, names):
+    """Generate a sequence of new names starting with `seed`, each of
+    which is not in `names` at the time it is generated.
+
+    This produces the same names as calling `fresh` repeatedly while
+    adding each new name to `names`, but it does not rescan the names it
+    has already skipped, so generating many names takes linear time.
+    """
     i = 1
     while True:
         name = seed + str(i)
         if name not in names:
-            return name
+            yield name
         i += 1
+
+
+def load(f):
+    """Load a Bril program from a file object.
+
+    The program may be in the usual JSON format or in the binary format
+    produced by `bril2bin`, which is detected by its leading magic bytes
+    and decoded with `briltxt`.
+    """
+    buf = getattr(f, 'buffer', f)
+    if buf.peek(1)[:1] == b'B':
+        import briltxt
+        return briltxt.load_bin(buf).to_json()
+    return json.load(f)